@@ -0,0 +1,108 @@
+
+import pickle
+import timeit
+import numpy as np
+import pandas as pd
+
+from strategyrunner.codec import EventCodec
+from strategyrunner.event import SignalEvent, SignalBatchEvent, SignalAckEvent, OrderEvent, FillEvent, QuoteEvent
+from strategyrunner.helpers import Signal, SparseVector, TickerIndex
+from strategyrunner import const
+
+
+class LegacyEvent:
+    """
+    stand-in with the attribute dicts the events carried before the codec, when they were pickled as they are
+    """
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+def legacy_event(event, tickers):
+    """
+    the dict based payload of an event, signals held an alpha for every ticker next to a template of zeros
+    """
+    if event.type == const.Event.SIGNAL:
+        template = {ticker: 0 for ticker in tickers}
+        alphas = dict(zip(tickers, event.signal.values().tolist()))
+        signal = LegacyEvent(tickers=tickers, template=template, signal=alphas)
+        return LegacyEvent(type=event.type, timestamp=event.timestamp, sid=event.sid, signal=signal)
+    if event.type == const.Event.SIGNAL_BATCH:
+        return LegacyEvent(type=event.type, timestamp=event.timestamp, sid=event.sid, seq=event.seq,
+                           signals=[legacy_event(signal, tickers) for signal in event.signals])
+    if event.type == const.Event.SIGNAL_ACK:
+        return LegacyEvent(type=event.type, sid=event.sid, seq=event.seq)
+    if event.type == const.Event.ORDER:
+        return LegacyEvent(type=event.type, timestamp=event.timestamp, sid=event.sid,
+                           orders={event.index.tickers[pos]: [order_type, qty] for pos, order_type, qty in
+                                   zip(event.positions.tolist(), event.order_types.tolist(),
+                                       event.quantities.tolist())})
+    if event.type == const.Event.FILL:
+        return LegacyEvent(type=event.type, timestamp=event.timestamp, sid=event.sid,
+                           fills={event.index.tickers[pos]: [qty, price, commission]
+                                  for pos, qty, price, commission in zip(event.positions.tolist(),
+                                                                         event.quantities.tolist(),
+                                                                         event.prices.tolist(),
+                                                                         event.commissions.tolist())})
+    if event.type == const.Event.QUOTE:
+        quotes = event.quotes
+        return LegacyEvent(type=event.type, timestamp=event.timestamp, sid=event.sid,
+                           quotes={quotes.index.tickers[pos]: price for pos, price in
+                                   zip(quotes.positions.tolist(), quotes.values.tolist())})
+    raise ValueError(f'Event type {event.type.name} has no legacy payload')
+
+
+def make_events(tickers, active, batch_size=32):
+    """
+    events of a strategy that holds active of the tickers
+    """
+    rng = np.random.default_rng(0)
+    timestamp = pd.Timestamp('2020-01-02')
+    index = TickerIndex(tickers)
+    positions = np.sort(rng.choice(len(tickers), active, replace=False))
+
+    signal = Signal(index)
+    signal.values()[positions] = rng.standard_normal(active)
+    signal_event = SignalEvent(timestamp, 'benchmark', signal)
+
+    quantities = rng.integers(1, 500, active) * rng.choice([-1, 1], active)
+    prices = rng.uniform(10, 200, active)
+    order = OrderEvent(timestamp, 'benchmark', index)
+    order.set(positions, const.Order.LMT, quantities)
+    fill = FillEvent(timestamp, 'benchmark', index)
+    fill.set(positions, prices, quantities)
+    quote = QuoteEvent(timestamp, 'benchmark', SparseVector(index, positions, prices))
+
+    return index, {
+        'signal': signal_event,
+        f'batch of {batch_size}': SignalBatchEvent(timestamp, 'benchmark',
+                                                   [SignalEvent(timestamp, 'benchmark', signal.copy())
+                                                    for _ in range(batch_size)], batch_size),
+        'ack': SignalAckEvent('benchmark', batch_size),
+        'order': order,
+        'fill': fill,
+        'quote': quote,
+    }
+
+
+def benchmark(n_tickers=3000, active=10, number=1000):
+    tickers = [f'T{idx:04d}' for idx in range(n_tickers)]
+    index, events = make_events(tickers, active)
+    codec = EventCodec(index)
+
+    print(f'{n_tickers} tickers with {active} active, {number} runs, times in us, the pickle columns are the dict '
+          f'based events the codec replaces')
+    print(f'{"event":>12} | {"pickle enc":>10} {"pickle dec":>10} {"bytes":>7} | {"codec enc":>10} {"codec dec":>10} '
+          f'{"bytes":>7}')
+    for name, event in events.items():
+        legacy = legacy_event(event, tickers)
+        pickled = pickle.dumps(legacy)
+        encoded = codec.encode(event)
+        times = [timeit.timeit(func, number=number) / number * 1e6 for func in
+                 [lambda: pickle.dumps(legacy), lambda: pickle.loads(pickled),
+                  lambda: codec.encode(event), lambda: codec.decode(encoded)]]
+        print(f'{name:>12} | {times[0]:10.1f} {times[1]:10.1f} {len(pickled):7d} | {times[2]:10.1f} {times[3]:10.1f} '
+              f'{len(encoded):7d}')
+
+if __name__ == '__main__':
+    benchmark()
@@ -1,7 +1,7 @@
 
 import zmq
 from concurrent import futures
-from strategyrunner.data import HistoricalDataRequest, RealTimeDataRequest, DataObject
+from strategyrunner.data import HistoricalDataRequest, RealTimeDataRequest, DataObject, Dispatcher
 import traceback
 
 
@@ -14,7 +14,7 @@ def request(cid):
     # socket.send_pyobj(HistoricalDataRequest(['AAPL'], '2014-01-01', '2018-07-30'))
     socket.send_pyobj(RealTimeDataRequest(['AAPL']))
     print(f'client {cid} request sent')
-    msg = socket.recv_pyobj()
+    msg = Dispatcher.from_frames(socket.recv_multipart(copy=False))
     print(msg)
     data_obj = msg.dispatch()  # type: DataObject
 
@@ -39,8 +39,8 @@ class AsyncAgent(ABC):
         for event in self.events:
             event.set()
 
-        for task in asyncio.Task.all_tasks():
-            if task is not asyncio.Task.current_task():
+        for task in asyncio.all_tasks():
+            if task is not asyncio.current_task():
                 task.cancel()
         self.loop.stop()
 
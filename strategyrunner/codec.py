@@ -0,0 +1,160 @@
+"""
+fixed binary encoding of the events exchanged between trader and manager
+
+every message starts with a tag byte (never 0x80, which starts a pickle, nor '{', which starts a data chunk
+header), the timestamp in int64 ns and the length-prefixed sid, followed by packed arrays with tickers given
+by their position in the account's TickerIndex. only the nonzero alphas of signals are sent
+"""
+
+import struct
+import numpy as np
+import pandas as pd
+
+from .event import SignalEvent, SignalBatchEvent, SignalAckEvent, OrderEvent, FillEvent, QuoteEvent
+from .helpers import Signal, SparseVector, TickerIndex
+from . import const
+
+
+SIGNAL = 1
+SIGNAL_BATCH = 2
+SIGNAL_ACK = 3
+ORDER = 4
+FILL = 5
+QUOTE = 6
+
+prefix = struct.Struct('<BqH')  # tag, timestamp in ns, sid length
+count = struct.Struct('<I')
+batch = struct.Struct('<QI')  # sequence number, number of signals
+sequence = struct.Struct('<Q')
+
+nat = np.iinfo('int64').min
+
+
+def is_encoded(buffer):
+    return len(buffer) > 0 and buffer[0] in (SIGNAL, SIGNAL_BATCH, SIGNAL_ACK, ORDER, FILL, QUOTE)
+
+
+def read_sid(buffer):
+    _, _, size = prefix.unpack_from(buffer)
+    return bytes(buffer[prefix.size:prefix.size + size]).decode()
+
+
+class EventCodec:
+    def __init__(self, tickers):
+        self.index = tickers if isinstance(tickers, TickerIndex) else TickerIndex(tickers)
+
+    def encode(self, event) -> bytes:
+        if event.type == const.Event.SIGNAL:
+            return self._prefix(SIGNAL, event.timestamp, event.sid) + self._alphas([event.signal])
+
+        if event.type == const.Event.SIGNAL_BATCH:
+            timestamps = np.array([self._ns(signal.timestamp) for signal in event.signals], dtype='int64')
+            return self._prefix(SIGNAL_BATCH, event.timestamp, event.sid) \
+                + batch.pack(event.seq, len(event.signals)) + timestamps.tobytes() \
+                + self._alphas([signal.signal for signal in event.signals])
+
+        if event.type == const.Event.SIGNAL_ACK:
+            return self._prefix(SIGNAL_ACK, None, event.sid) + sequence.pack(event.seq)
+
+        if event.type == const.Event.ORDER:
+            return self._prefix(ORDER, event.timestamp, event.sid) + count.pack(len(event.positions)) \
+                + event.positions.astype('int32').tobytes() + event.order_types.tobytes() \
+                + event.quantities.tobytes()
+
+        if event.type == const.Event.FILL:
+            return self._prefix(FILL, event.timestamp, event.sid) + count.pack(len(event.positions)) \
+                + event.positions.astype('int32').tobytes() + event.quantities.tobytes() \
+                + event.prices.tobytes() + event.commissions.tobytes()
+
+        if event.type == const.Event.QUOTE:
+            quotes = event.quotes
+            return self._prefix(QUOTE, event.timestamp, event.sid) + count.pack(len(quotes)) \
+                + quotes.positions.astype('int32').tobytes() + quotes.values.astype('float64').tobytes()
+
+        raise ValueError(f'Event type {event.type.name} has no binary encoding')
+
+    def decode(self, buffer):
+        tag, timestamp, size = prefix.unpack_from(buffer)
+        sid = bytes(buffer[prefix.size:prefix.size + size]).decode()
+        timestamp = pd.Timestamp(timestamp) if timestamp != nat else None
+        offset = prefix.size + size
+
+        if tag == SIGNAL:
+            return SignalEvent(timestamp, sid, self._signals(buffer, offset, 1)[0])
+
+        if tag == SIGNAL_BATCH:
+            seq, m = batch.unpack_from(buffer, offset)
+            offset += batch.size
+            timestamps = [pd.Timestamp(ts) for ts in np.frombuffer(buffer, 'int64', m, offset).tolist()]
+            signals = self._signals(buffer, offset + 8 * m, m)
+            return SignalBatchEvent(timestamp, sid, [SignalEvent(ts, sid, signal)
+                                                     for ts, signal in zip(timestamps, signals)], seq)
+
+        if tag == SIGNAL_ACK:
+            return SignalAckEvent(sid, sequence.unpack_from(buffer, offset)[0])
+
+        k = count.unpack_from(buffer, offset)[0]
+        offset += count.size
+        positions = np.frombuffer(buffer, 'int32', k, offset).astype('intp')
+        offset += 4 * k
+
+        if tag == ORDER:
+            order = OrderEvent(timestamp, sid, self.index)
+            order.set(positions, np.frombuffer(buffer, 'uint8', k, offset).copy(),
+                      np.frombuffer(buffer, 'int64', k, offset + k).copy())
+            return order
+
+        if tag == FILL:
+            quantities = np.frombuffer(buffer, 'int64', k, offset).copy()
+            prices, commissions = np.frombuffer(buffer, 'float64', 2 * k, offset + 8 * k).reshape(2, k).copy()
+            fill = FillEvent(timestamp, sid, self.index)
+            fill.set(positions, prices, quantities, commissions)
+            return fill
+
+        if tag == QUOTE:
+            prices = np.frombuffer(buffer, 'float64', k, offset).copy()
+            return QuoteEvent(timestamp, sid, SparseVector(self.index, positions, prices))
+
+        raise ValueError(f'Unrecognized event tag {tag}')
+
+    def _prefix(self, tag, timestamp, sid):
+        sid = sid.encode()
+        return prefix.pack(tag, self._ns(timestamp), len(sid)) + sid
+
+    def _alphas(self, signals):
+        """
+        the nonzero alphas of every signal, counts then positions then values
+        """
+        dense = np.stack([self._dense(signal) for signal in signals])
+        rows, positions = np.nonzero(dense != 0)
+        counts = np.bincount(rows, minlength=len(signals)).astype('uint32')
+        return counts.tobytes() + positions.astype('int32').tobytes() + dense[rows, positions].tobytes()
+
+    def _dense(self, signal: Signal):
+        if signal.index is self.index or signal.tickers == self.index.tickers:
+            return signal.values()
+        # a signal over other tickers is mapped by name
+        dense = np.zeros(len(self.index))
+        for ticker, alpha in signal.items():
+            dense[self.index[ticker]] = alpha
+        return dense
+
+    def _signals(self, buffer, offset, m):
+        """
+        dense signals from the sparse alphas at offset
+        """
+        counts = np.frombuffer(buffer, 'uint32', m, offset)
+        total = int(counts.sum())
+        offset += 4 * m
+        positions = np.frombuffer(buffer, 'int32', total, offset)
+        values = np.frombuffer(buffer, 'float64', total, offset + 4 * total)
+
+        rows = np.repeat(np.arange(m), counts)
+        alphas = np.zeros((m, len(self.index)))
+        alphas[rows, positions] = values
+
+        return [Signal(self.index, row) for row in alphas]
+
+    @staticmethod
+    def _ns(timestamp):
+        return pd.Timestamp(timestamp).value if timestamp is not None else nat
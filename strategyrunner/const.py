@@ -11,6 +11,12 @@ class Event(Enum):
     ACCT_OPEN = 6
     ACCT_CLOSE = 7
     DATA = 8
+    DATA_RELEASE = 9
+    DATA_CHUNK = 10
+    FEED_STATUS = 11
+    SIGNAL_BATCH = 12
+    SIGNAL_ACK = 13
+    QUOTE_BLOCK = 14
 
 
 class Data(Enum):
@@ -23,6 +29,11 @@ class Broker(Enum):
     INTERACTIVE_BROKERS = 'IB'  # IB
 
 
+class Engine(Enum):
+    DISTRIBUTED = 1  # through the portfolio manager
+    LOCAL = 2  # in the trader process, simulated broker only
+
+
 class Order(Enum):
     LMT = 1
     MKT = 2
@@ -1,3 +1,6 @@
+from .panel import Panel
+from .column_store import ColumnStore
+from .trading_calendar import TradingCalendar
 
 from .data_manager import DataManager
 from .data_object import DataObject, HistoricalDataObject, RealTimeDataObject, Dispatcher
@@ -0,0 +1,48 @@
+"""
+memory admission control for the data server
+"""
+
+import asyncio
+
+
+class AdmissionController:
+    """
+    bounds the bytes of data being loaded or streamed at once, requests that don't fit wait in a bounded queue
+    and requests that can never fit are rejected
+    """
+    def __init__(self, budget, max_waiting=32):
+        self.budget = budget
+        self.max_waiting = max_waiting
+        self.used = 0
+        self.waiting = 0
+        self.rejected = 0
+        self.condition = asyncio.Condition()
+
+    def __str__(self):
+        return f'Memory {self.used / 2 ** 20:.1f} of {self.budget / 2 ** 20:.1f}MB reserved / ' \
+               f'{self.waiting} waiting / {self.rejected} rejected'
+
+    def __repr__(self):
+        return self.__str__()
+
+    async def acquire(self, nbytes):
+        if nbytes > self.budget:
+            self.rejected += 1
+            raise ValueError(f'Request needs {nbytes / 2 ** 20:.1f}MB, more than the {self.budget / 2 ** 20:.1f}MB '
+                             f'budget, stream it in smaller chunks')
+        if self.used + nbytes > self.budget and self.waiting >= self.max_waiting:
+            self.rejected += 1
+            raise ValueError(f'Too many requests waiting for memory ({self.waiting})')
+
+        async with self.condition:
+            self.waiting += 1
+            try:
+                await self.condition.wait_for(lambda: self.used + nbytes <= self.budget)
+            finally:
+                self.waiting -= 1
+            self.used += nbytes
+
+    async def release(self, nbytes):
+        async with self.condition:
+            self.used -= nbytes
+            self.condition.notify_all()
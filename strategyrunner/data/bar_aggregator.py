@@ -0,0 +1,142 @@
+"""
+vectorized OHLCV aggregation of ticks for all tickers at several bar resolutions
+"""
+
+import time
+import numpy as np
+import pandas as pd
+
+
+class CompletedBar:
+    def __init__(self, resolution, end, open_, high, low, close, volume):
+        self.resolution = resolution  # seconds
+        self.end = end  # int64 ns, exclusive end of the bar
+        self.open = open_
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+
+    def __str__(self):
+        return f'{self.resolution}s bar ending {self.timestamp}'
+
+    def __repr__(self):
+        return self.__str__()
+
+    @property
+    def timestamp(self):
+        return pd.Timestamp(self.end)
+
+
+class BarAggregator:
+    """
+    one row of (resolution x ticker) arrays per resolution, bars are aligned to multiples of the resolution
+    since the epoch and close on tick time or on the clock passed to advance, whichever comes first
+
+    a ticker without ticks in a bar gets the previous close as a flat bar with zero volume, intervals in which
+    no ticker traded at all (e.g. market closed) are skipped rather than filled
+    """
+    def __init__(self, tickers, resolutions=(5,)):
+        self.tickers = list(tickers)
+        self.positions = {ticker: idx for idx, ticker in enumerate(self.tickers)}
+        self.resolutions = list(resolutions)
+        self.steps = np.array([int(resolution * 1e9) for resolution in self.resolutions], dtype='int64')
+
+        shape = (len(self.steps), len(self.tickers))
+        self.open = np.full(shape, np.nan)
+        self.high = np.full(shape, np.nan)
+        self.low = np.full(shape, np.nan)
+        self.close = np.full(shape, np.nan)
+        self.volume = np.zeros(shape)
+        self.last_close = np.full(shape, np.nan)
+        self.ends = np.zeros(len(self.steps), dtype='int64')  # end of the open bar, 0 before the first tick
+        self.ticks = 0
+
+    def __str__(self):
+        return f'Bar aggregator of {len(self.tickers)} tickers at {self.resolutions}s / {self.ticks} ticks'
+
+    def __repr__(self):
+        return self.__str__()
+
+    def columns(self, tickers):
+        return np.fromiter((self.positions[ticker] for ticker in tickers), dtype='intp', count=len(tickers))
+
+    def add(self, columns, prices, sizes=None, timestamps=None):
+        """
+        add a batch of ticks, columns are ticker positions (see columns), sizes default to 1 so that volume
+        counts ticks and timestamps are exchange times in ns defaulting to the wall clock
+        return the bars completed by the batch, ticks older than the open bar are added to it
+        """
+        columns = np.asarray(columns, dtype='intp')
+        prices = np.asarray(prices, dtype='float64')
+        sizes = np.ones(prices.shape[0]) if sizes is None else np.asarray(sizes, dtype='float64')
+        if timestamps is None:
+            timestamps = np.full(prices.shape[0], time.time_ns(), dtype='int64')
+        else:
+            timestamps = np.asarray(timestamps, dtype='int64')
+            if np.any(np.diff(timestamps) < 0):
+                order = np.argsort(timestamps, kind='stable')
+                columns, prices, sizes, timestamps = columns[order], prices[order], sizes[order], timestamps[order]
+
+        self.ticks += prices.shape[0]
+        completed = []
+        for row, step in enumerate(self.steps):
+            buckets = timestamps // step
+            # ticks are in time order so each bar is a contiguous run of the batch
+            bounds = np.flatnonzero(np.diff(buckets)) + 1
+            for lo, hi in zip(np.r_[0, bounds], np.r_[bounds, buckets.shape[0]]):
+                completed += self._close(row, buckets[lo] * step)
+                self._update(row, columns[lo:hi], prices[lo:hi], sizes[lo:hi])
+        return sorted(completed, key=lambda bar: (bar.end, bar.resolution))
+
+    def advance(self, now=None):
+        """
+        close bars ending at or before now (ns, defaults to the wall clock), for when ticks are sparse
+        """
+        now = time.time_ns() if now is None else int(now)
+        completed = []
+        for row in range(len(self.steps)):
+            completed += self._close(row, now)
+        return sorted(completed, key=lambda bar: (bar.end, bar.resolution))
+
+    def next_end(self):
+        """
+        earliest end of the open bars in ns, None before the first tick
+        """
+        started = self.ends[self.ends > 0]
+        return int(started.min()) if started.shape[0] > 0 else None
+
+    def _update(self, row, columns, prices, sizes):
+        tickers, first = np.unique(columns, return_index=True)
+        fresh = np.isnan(self.open[row, tickers])
+        self.open[row, tickers[fresh]] = prices[first[fresh]]
+        np.fmax.at(self.high[row], columns, prices)
+        np.fmin.at(self.low[row], columns, prices)
+        tickers, last = np.unique(columns[::-1], return_index=True)
+        self.close[row, tickers] = prices[::-1][last]
+        np.add.at(self.volume[row], columns, sizes)
+
+    def _close(self, row, now):
+        step = self.steps[row]
+        if self.ends[row] == 0:
+            self.ends[row] = now // step * step + step
+            return []
+        if self.ends[row] > now:
+            return []
+
+        completed = []
+        traded = ~np.isnan(self.close[row])
+        if traded.any():
+            flat = ~traded
+            for array in (self.open, self.high, self.low, self.close):
+                array[row, flat] = self.last_close[row, flat]
+            completed.append(CompletedBar(self.resolutions[row], int(self.ends[row]), self.open[row].copy(),
+                                          self.high[row].copy(), self.low[row].copy(), self.close[row].copy(),
+                                          self.volume[row].copy()))
+            self.last_close[row] = np.where(np.isnan(self.close[row]), self.last_close[row], self.close[row])
+            for array in (self.open, self.high, self.low, self.close):
+                array[row] = np.nan
+            self.volume[row] = 0
+
+        self.ends[row] = now // step * step + step
+        return completed
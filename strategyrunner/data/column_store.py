@@ -0,0 +1,132 @@
+"""
+columnar price store, one memory-mapped array file per field per ticker
+
+the files of a ticker live in a numbered version folder named by the ticker's current file, a rebuild writes
+the next version and switches the pointer so that readers never see a half replaced ticker
+"""
+
+import os
+from pathlib import Path
+import shutil
+import numpy as np
+import pandas as pd
+
+
+class ColumnStore:
+    # date is int64 ns and is written last so that its length bounds the valid rows of every field
+    # volume is float so that a missing volume stays NaN like on the sqlite path
+    dtypes = {
+        'open': 'float64',
+        'high': 'float64',
+        'low': 'float64',
+        'close': 'float64',
+        'volume': 'float64',
+        'date': 'int64'
+    }
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def last_date(self, ticker):
+        dates = self._map(self._folder(ticker), 'date')
+        if dates.shape[0] == 0:
+            return None
+        return pd.Timestamp(dates[-1])
+
+    def append(self, ticker, data: pd.DataFrame):
+        """
+        append bars indexed by date, which must all be later than the last stored date
+        """
+        if data.shape[0] == 0:
+            return
+
+        last_date = self.last_date(ticker)
+        if last_date is not None and data.index.min() <= last_date:
+            raise ValueError(f'{ticker} bars overlap column store ending {last_date}')
+
+        folder = self._folder(ticker)
+        if folder is None:
+            self.rebuild(ticker, data)
+            return
+        for field, array in self._to_arrays(data).items():
+            with open(folder / f'{field}.bin', 'ab') as f:
+                f.write(array.tobytes())
+
+    def rebuild(self, ticker, data: pd.DataFrame):
+        """
+        replace all stored bars of a ticker with a new version
+        """
+        root = self.root / ticker
+        root.mkdir(exist_ok=True)
+        current = self._version(ticker)
+        version = str(int(current) + 1) if current is not None else '0'
+        folder = root / version
+        if folder.exists():
+            shutil.rmtree(folder)
+        folder.mkdir()
+        for field, array in self._to_arrays(data).items():
+            array.tofile(folder / f'{field}.bin')
+
+        pointer = root / 'current.tmp'
+        pointer.write_text(version)
+        os.replace(pointer, root / 'current')
+
+        # the replaced version is kept for readers that resolved it just before the switch, readers holding maps
+        # of older ones keep their files alive
+        for path in root.iterdir():
+            if path.name in ('current', version, current):
+                continue
+            if path.is_dir():
+                shutil.rmtree(path)
+            else:
+                path.unlink()
+
+    def read(self, ticker, start_date, end_date):
+        """
+        return {field: array} of bars between start and end date (inclusive) as views on the mapped files
+        """
+        while True:
+            folder = self._folder(ticker)
+            try:
+                return self._read(folder, start_date, end_date)
+            except FileNotFoundError:
+                # the version was dropped by rebuilds while being mapped, read the current one instead
+                if self._folder(ticker) == folder:
+                    raise
+
+    def _read(self, folder, start_date, end_date):
+        dates = self._map(folder, 'date')
+        lo = np.searchsorted(dates, pd.Timestamp(start_date).value, side='left')
+        hi = np.searchsorted(dates, pd.Timestamp(end_date).value, side='right')
+
+        data = {'date': dates[lo:hi]}
+        for field in self.dtypes:
+            if field != 'date':
+                data[field] = self._map(folder, field, dates.shape[0])[lo:hi]
+        return data
+
+    def _version(self, ticker):
+        try:
+            return (self.root / ticker / 'current').read_text()
+        except FileNotFoundError:
+            return None
+
+    def _folder(self, ticker):
+        version = self._version(ticker)
+        return self.root / ticker / version if version is not None else None
+
+    def _map(self, folder, field, length=None):
+        dtype = np.dtype(self.dtypes[field])
+        file = folder / f'{field}.bin' if folder is not None else None
+        size = file.stat().st_size // dtype.itemsize if file is not None else 0
+        if length is not None:
+            size = min(size, length)
+        if size == 0:
+            return np.empty(0, dtype=dtype)
+        return np.asarray(np.memmap(file, dtype=dtype, mode='r', shape=(size,)))
+
+    def _to_arrays(self, data: pd.DataFrame):
+        arrays = {field: data[field].values.astype(dtype) for field, dtype in self.dtypes.items() if field != 'date'}
+        arrays['date'] = data.index.values.astype('datetime64[ns]').view('int64')
+        return arrays
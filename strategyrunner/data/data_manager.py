@@ -4,11 +4,17 @@ handle data
 """
 
 import sqlite3
+from concurrent import futures
+import time
 import pandas_datareader.data as web
 from pandas_datareader.stooq import StooqDailyReader
 import pandas_market_calendars as mcal
 import pandas as pd
+import numpy as np
 from strategyrunner.utils import rdate, parse_time
+from .column_store import ColumnStore
+from .panel import Panel
+from .trading_calendar import TradingCalendar
 
 
 def process_tiingo(df):
@@ -17,24 +23,94 @@ def process_tiingo(df):
     df.rename(lambda x: x.replace("adj", ""), axis=1, inplace=True)
 
 
+def read_stooq(symbol, start_date, end_date):
+    data = StooqDailyReader(symbol, start_date, end_date).read()
+    if data.shape[0] == 0:
+        raise KeyError(f'{symbol} is not available from stooq')
+    return data
+
+
+# source -> [ticker suffix, history limit, post-processor, reader(symbol, start, end)]
+# sources without a reader go through pandas_datareader; sources are ranked in this order for new databases
 source_map = {
-    "tiingo": ["", None, process_tiingo],
-    "stooq": [".US", None, None],
-    "av-daily": ["", None, None],
-    "iex": ["", rdate("5y"), None]
+    "tiingo": ["", None, process_tiingo, None],
+    "stooq": [".US", None, None, read_stooq],
+    "av-daily": ["", None, None, None],
+    "iex": ["", rdate("5y"), None, None]
 }
 
 
+def earliest(*dates):
+    dates = [date for date in dates if date is not None]
+    return min(dates) if len(dates) > 0 else None
+
+
+class UpdateStats:
+    """
+    download throughput of one source during a bulk update
+    """
+    def __init__(self, source):
+        self.source = source
+        self.requests = 0
+        self.failures = 0
+        self.bars = 0
+        self.seconds = 0.0
+
+    def add(self, data, seconds):
+        self.requests += 1
+        self.seconds += seconds
+        if data is not None:
+            self.bars += data.shape[0]
+
+    def add_failure(self):
+        self.requests += 1
+        self.failures += 1
+
+    def __str__(self):
+        rate = self.requests / self.seconds if self.seconds > 0 else 0
+        return f'{self.source}: {self.requests} requests ({self.failures} failed), {self.bars} bars, ' \
+               f'{self.seconds:.1f}s busy, {rate:.2f} requests/s per worker'
+
+    def __repr__(self):
+        return self.__str__()
+
+
 class DataManager:
-    def __init__(self, sqlite_file):
+    def __init__(self, sqlite_file, column_dir=None, refresh='session'):
+        """
+        refresh is the staleness policy of (ticker, source) pairs
+        'session': check each pair at most once per trading session, after the close
+        'always': check every pair on every request
+        """
+        if refresh not in ('session', 'always'):
+            raise ValueError(f'Unrecognized refresh policy {refresh}')
+
         self.sqlite_file = sqlite_file
         self.epoch = pd.Timestamp(1970, 2, 19)
+        self.refresh = refresh
+        self.market_close = pd.Timedelta(hours=16)  # exchange local time
+        self.calendar = None  # type: TradingCalendar
+        self.calendar_file = None if sqlite_file == ':memory:' else f'{sqlite_file}.calendar.npy'
+
+        # optional columnar copy of the source-resolved bars, sqlite stays the source of truth
+        self.store = ColumnStore(column_dir) if column_dir else None
 
     def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def open(self, check_same_thread=True):
+        """
+        connect as the writer and set up tables, check_same_thread=False lets a long-lived writer be used from
+        other threads as long as the caller serializes access
+        """
         try:
             print(self.sqlite_file)
-            self.conn = sqlite3.connect(self.sqlite_file)
+            self.conn = sqlite3.connect(self.sqlite_file, check_same_thread=check_same_thread)
             self.cur = self.conn.cursor()
+            self.conn.execute('pragma journal_mode=wal')  # readers don't block on the writer
 
             if not self._table_exists('SourceRank'):
                 self._initialize_source_rank_table()
@@ -48,28 +124,87 @@ class DataManager:
 
         self._update_calendar()
         self._ensure_trial_table()
+        self._ensure_update_log_table()
+        self._check_source_rank()
         return self
 
-    def __exit__(self, exc_type, exc_val, exc_tb):
+    def open_reader(self):
+        """
+        read-only connection for read_panel, skipping the set up already done by the writer
+        """
+        self.conn = sqlite3.connect(f'file:{self.sqlite_file}?mode=ro', uri=True)
+        self.cur = self.conn.cursor()
+        self.sources = self._get_list_from_db("SourceRank", "source")
+        self.calendar = TradingCalendar.load(self.conn, self.calendar_file)
+        return self
+
+    def close(self):
         self.conn.close()
 
-    def get_data(self, tickers, start_date, end_date=None):
+    def get_data(self, tickers, start_date, end_date=None, as_panel=False, max_workers=None, missing='nan'):
+        """
+        update tickers from the web and read them back, max_workers switches to the concurrent bulk update
+        see read_panel for the missing data policy
+        """
         # check time input and parse
         start_date = pd.Timestamp(start_date)
-        end_date = pd.Timestamp.today().date() if end_date is None else pd.Timestamp(end_date)
+        end_date = pd.Timestamp(pd.Timestamp.today().date()) if end_date is None else pd.Timestamp(end_date)
 
-        # create table if needed and update
-        for ticker in tickers:
-            self._create_ticker_table(ticker)
-            for source in self.sources:
-                try:
-                    self._update_data_from_web(ticker, source)
-                except Exception as e:
-                    print(e)
-                    print(f"Failed to retrieve {ticker} from {source}")
-            print(f"Done updating {ticker}\n")
+        self.update_data(tickers, max_workers)
+        panel = self.read_panel(tickers, start_date, end_date, missing)
+        return panel if as_panel else panel.to_frame()
+
+    def update_data(self, tickers, max_workers=None):
+        """
+        create tables if needed and update stale tickers, max_workers switches to the concurrent bulk update
+        return the first new date of each ticker, or None if nothing is added
+        """
+        if max_workers is None:
+            new_dates = {}
+            stale = self._get_stale_sources(tickers)
+            for ticker in tickers:
+                self._create_ticker_table(ticker)
+                new_dates[ticker] = None
+                for source in stale[ticker]:
+                    try:
+                        new_dates[ticker] = earliest(new_dates[ticker], self._update_data_from_web(ticker, source))
+                        self._mark_checked([(ticker, source)])
+                        self.conn.commit()
+                    except Exception as e:
+                        print(e)
+                        print(f"Failed to retrieve {ticker} from {source}")
+                if len(stale[ticker]) > 0:
+                    print(f"Done updating {ticker}\n")
+        else:
+            new_dates = self._update_concurrently(tickers, max_workers)
 
-        return self._read_tickers_from_db(tickers, start_date, end_date)
+        if self.store is not None:
+            for ticker in tickers:
+                self._sync_column_store(ticker, new_dates[ticker])
+        return new_dates
+
+    def read_panel(self, tickers, start_date, end_date, missing='nan'):
+        """
+        read tickers straight into (date x ticker) arrays aligned to the market calendar
+        missing is the policy for calendar dates without a bar, see Panel.fill_missing
+        """
+        start_date, end_date = pd.Timestamp(start_date), min(pd.Timestamp(end_date), pd.Timestamp.today())
+        index = self.calendar.between(start_date, end_date)
+        if self.store is not None and len(tickers) == 1:
+            # a single ticker covering the whole calendar is wrapped without copying
+            column = self.store.read(tickers[0], start_date, end_date)
+            if np.array_equal(column['date'], index):
+                panel = Panel(tickers, index, *[column[field][:, None] for field in Panel.fields])
+                return panel.fill_missing(missing)
+
+        arrays = [np.full((index.shape[0], len(tickers)), np.nan) for _ in Panel.fields]
+        if self.store is not None:
+            for idx, ticker in enumerate(tickers):
+                column = self.store.read(ticker, start_date, end_date)
+                self._fill_panel_column(arrays, index, idx, column['date'], [column[field] for field in Panel.fields])
+        else:
+            self._fill_panel_from_db(arrays, index, tickers, start_date, end_date)
+        return Panel(tickers, index, *arrays).fill_missing(missing)
 
     def _table_exists(self, table_name):
         res = self.cur.execute("select name from sqlite_master where type='table' AND name=?", (table_name,))
@@ -102,7 +237,100 @@ class DataManager:
                 primary key(date, source)
             )
         """)
+        if not self._table_exists(f'{ticker}_resolved'):
+            self._create_resolved_table(ticker)
+            self._rebuild_resolved_table(ticker)
+        self.conn.commit()
+
+    def _create_resolved_table(self, ticker):
+        """
+        bars of the best ranked source per date, maintained on insert so that reads are a plain range scan
+        """
+        self.conn.execute(f"""
+            create table if not exists {ticker}_resolved (
+                date timestamp primary key,
+                open real,
+                high real,
+                low real,
+                close real,
+                volume integer,
+                source text,
+                rank integer
+            )
+        """)
+
+    def _rebuild_resolved_table(self, ticker):
+        self.conn.execute(f'delete from {ticker}_resolved')
+        self.conn.execute(f"""
+            insert into {ticker}_resolved (date, open, high, low, close, volume, source, rank)
+            select a.date, a.open, a.high, a.low, a.close, a.volume, a.source, b.rank
+            from {ticker} a 
+                inner join SourceRank b on a.source = b.source
+            where b.rank = (
+                select min(d.rank) 
+                from {ticker} c inner join SourceRank d on c.source = d.source 
+                where c.date = a.date
+            )
+        """)
+        self.conn.commit()
+
+    def _merge_into_resolved_table(self, ticker, source, start_date):
+        """
+        upsert newly inserted bars of a source, keeping the existing bar if its source ranks better
+        the caller commits
+        """
+        self.conn.execute(f"""
+            insert into {ticker}_resolved (date, open, high, low, close, volume, source, rank)
+            select a.date, a.open, a.high, a.low, a.close, a.volume, a.source, b.rank
+            from {ticker} a 
+                inner join SourceRank b on a.source = b.source
+            where a.source = ? and a.date >= ?
+            on conflict(date) do update set
+                open = excluded.open,
+                high = excluded.high,
+                low = excluded.low,
+                close = excluded.close,
+                volume = excluded.volume,
+                source = excluded.source,
+                rank = excluded.rank
+            where excluded.rank <= {ticker}_resolved.rank
+        """, (source, str(start_date)))
+
+    def set_source_rank(self, ranks: dict):
+        """
+        re-rank sources, e.g. {'tiingo': 1, 'stooq': 2, ...}, and re-resolve every ticker
+        """
+        if set(ranks.keys()) != set(self.sources):
+            raise ValueError("ranks and sources doesn't match")
+
+        # rank is unique so rows are replaced instead of updated one by one
+        self.conn.execute('delete from SourceRank')
+        self.conn.executemany('insert into SourceRank (source, rank) values(?, ?)', list(ranks.items()))
+        self.conn.commit()
+        self._check_source_rank()
+
+    def _check_source_rank(self):
+        """
+        rebuild resolved tables if SourceRank changed since they were last resolved
+        """
+        self.conn.execute('create table if not exists ResolvedRank (source text primary key, rank integer)')
+        current = dict(self.cur.execute('select source, rank from SourceRank').fetchall())
+        resolved = dict(self.cur.execute('select source, rank from ResolvedRank').fetchall())
+        if current == resolved:
+            return
+
+        tickers = [name[:-len('_resolved')] for name in self._get_list_from_db('sqlite_master', 'name')
+                   if name.endswith('_resolved')]
+        for ticker in tickers:
+            self._rebuild_resolved_table(ticker)
+            if self.store is not None:
+                self._sync_column_store(ticker, self.epoch)
+
+        self.conn.execute('delete from ResolvedRank')
+        self.conn.executemany('insert into ResolvedRank (source, rank) values(?, ?)', list(current.items()))
         self.conn.commit()
+        if len(tickers) > 0:
+            print(f'Re-resolved {len(tickers)} tickers with source rank {current}')
 
     def _initialize_source_rank_table(self):
         self.conn.execute(f'''
@@ -113,25 +341,33 @@ class DataManager:
             )
         ''')
         self.conn.commit()
-        ranks = pd.DataFrame({'source': ['tiingo', 'stooq', 'av-daily', 'iex'], 'rank': [1, 2, 3, 4]})
+        ranks = pd.DataFrame({'source': list(source_map.keys()), 'rank': range(1, len(source_map) + 1)})
         ranks.to_sql('SourceRank', con=self.conn, index=False, if_exists='append')
 
     def _update_calendar(self):
+        """
+        load the shared trading calendar, MarketCalendarUS is kept a year ahead so that
+        pandas_market_calendars is only consulted about once a month
+        """
         mcal_name = 'MarketCalendarUS'
 
         # create if not exists
         self.conn.execute(f'create table if not exists {mcal_name} (date timestamp primary key)')
         self.conn.commit()
 
-        last_date = self._get_last_date_from_db(mcal_name)
-        if last_date is None:
-            last_date = self.epoch
+        self.calendar = TradingCalendar.load(self.conn, self.calendar_file)
+        today = pd.Timestamp.today().normalize()
+        last_date = self.calendar.last_date
+        if last_date is not None and last_date >= today + rdate("1m"):
+            return
 
         # get market dates and insert if needed
         nyse = mcal.get_calendar("NYSE")
-        dates = nyse.valid_days(start_date=last_date + rdate("1b"), end_date=pd.Timestamp.today())
+        dates = nyse.valid_days(start_date=(last_date or self.epoch) + rdate("1b"), end_date=today + rdate("1y"))
         if len(dates) > 0:  # term
             dates.to_series(name="date").to_sql(mcal_name, con=self.conn, index=False, if_exists="append")
+        self.calendar = TradingCalendar.load(self.conn)
+        self.calendar.save(self.calendar_file)
 
     def _ensure_trial_table(self):
         self.conn.execute('''
@@ -153,76 +389,266 @@ class DataManager:
             return 0
         return res[0]
 
-    def _increment_trial_count(self, ticker, source):
+    def _increment_trial_count(self, ticker, source, commit=True):
         self.conn.execute(f"update trials set count = count + 1 where ticker = '{ticker}' and source = '{source}'")
+        if commit:
+            self.conn.commit()
+
+    def _update_concurrently(self, tickers, max_workers, batch_size=50):
+        """
+        bulk update, downloading ticker x source pairs concurrently while this thread stays the only writer
+        """
+        jobs = []
+        checked = []
+        stale = self._get_stale_sources(tickers)
+        for ticker in tickers:
+            self._create_ticker_table(ticker)
+            for source in stale[ticker]:
+                dates = self._plan_update(ticker, source)
+                if dates is not None:
+                    jobs.append((ticker, source) + dates)
+                else:
+                    checked.append((ticker, source))
+        with self.conn:
+            self._mark_checked(checked)
+
+        new_dates = {ticker: None for ticker in tickers}
+        stats = {source: UpdateStats(source) for source in self.sources}
+        wall_time_start = time.time()
+        with futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+            pending = {pool.submit(self._timed_download, *job): job[:2] for job in jobs}
+            batch = []
+            for future in futures.as_completed(pending):
+                ticker, source = pending[future]
+                try:
+                    data, seconds = future.result()
+                except Exception as e:
+                    print(e)
+                    print(f"Failed to retrieve {ticker} from {source}")
+                    stats[source].add_failure()
+                    continue
+
+                stats[source].add(data, seconds)
+                batch.append((ticker, source, data))
+                if len(batch) >= batch_size:
+                    self._write_batch(batch, new_dates)
+                    batch = []
+            self._write_batch(batch, new_dates)
+
+        print(f"Updated {len(tickers)} tickers with {len(jobs)} downloads in {time.time() - wall_time_start:.1f}s")
+        for source_stats in stats.values():
+            if source_stats.requests > 0:
+                print(source_stats)
+        return new_dates
+
+    def _write_batch(self, batch, new_dates):
+        """
+        store a batch of downloads in one transaction, each pair under its own savepoint so that a pair that
+        fails to insert is rolled back and left stale like in the sequential update, without losing the others
+        """
+        with self.conn:
+            if not self.conn.in_transaction:
+                self.conn.execute('begin')
+            written = []
+            for ticker, source, data in batch:
+                self.conn.execute('savepoint pair')
+                try:
+                    if data is None:
+                        self._increment_trial_count(ticker, source, commit=False)
+                    else:
+                        first = self._insert_bars(ticker, source, data)
+                except Exception as e:
+                    self.conn.execute('rollback to pair')
+                    self.conn.execute('release pair')
+                    print(e)
+                    print(f"Failed to store {ticker} from {source}")
+                    continue
+
+                self.conn.execute('release pair')
+                written.append((ticker, source))
+                if data is not None:
+                    new_dates[ticker] = earliest(new_dates[ticker], first)
+            self._mark_checked(written)
+
+    def _ensure_update_log_table(self):
+        self.conn.execute('''
+            create table if not exists UpdateLog (
+                ticker text,
+                source text,
+                checked timestamp,
+                primary key(ticker, source)
+            )
+        ''')
         self.conn.commit()
 
-    def _update_data_from_web(self, ticker, source) -> None:
+    def _mark_checked(self, pairs):
+        """
+        record successful checks of (ticker, source) pairs without committing
+        """
+        checked = str(self._exchange_now())
+        self.conn.executemany('''
+            insert into UpdateLog (ticker, source, checked) values(?, ?, ?)
+            on conflict(ticker, source) do update set checked = excluded.checked
+        ''', [(ticker, source, checked) for ticker, source in pairs])
+
+    def _get_stale_sources(self, tickers):
+        """
+        return {ticker: [sources to refresh]}, in rank order
+        """
+        if self.refresh == 'always':
+            return {ticker: list(self.sources) for ticker in tickers}
+
+        last_close = str(self._last_session_close())
+        fresh = set(self.cur.execute(f'''
+            select ticker, source from UpdateLog
+            where checked >= ? and ticker in ({", ".join("?" * len(tickers))})
+        ''', [last_close] + list(tickers)).fetchall())
+        return {ticker: [source for source in self.sources if (ticker, source) not in fresh] for ticker in tickers}
+
+    def _exchange_now(self):
+        return pd.Timestamp.now(tz='America/New_York').tz_localize(None).floor('s')
+
+    def _last_session_close(self):
+        """
+        close of the latest trading session that has already ended, in exchange local time
+        """
+        now = self._exchange_now()
+        session = self.calendar.previous(now.normalize() + pd.Timedelta(days=1))
+        if now < session + self.market_close:
+            session = self.calendar.previous(session)
+        return session + self.market_close
+
+    def _update_data_from_web(self, ticker, source):
         """
         download and merge data into database
-        start date is the last updated date + 1 and end date is today
+        start date is the last updated date + 1 and end date is the last closed session
+        return the first downloaded date, or None if nothing is added
         """
+        dates = self._plan_update(ticker, source)
+        if dates is None:
+            return None
+
+        data = self._download(ticker, source, *dates)
+        if data is None:
+            self._increment_trial_count(ticker, source)
+            return None
+
+        sdate = self._insert_bars(ticker, source, data)
+        self.conn.commit()
+        return sdate
 
+    def _plan_update(self, ticker, source):
+        """
+        return the (start, end) dates to download, or None if the source is skipped or already up to date
+        """
         # check if source is available for the ticker
         if self._get_number_of_trials(ticker, source) > 3:
             print(f'{ticker} from {source} is skipped', flush=True)
-            return
-        suffix, relative_limit, processor = source_map[source]
+            return None
+        relative_limit = source_map[source][1]
 
-        # configure start, end dates
-        today = pd.Timestamp.today() - rdate("1b")
-        start_date = self._get_last_date_from_db(ticker, source) + rdate("1b")
-        if relative_limit is not None and start_date < today - relative_limit:
-            start_date = today - relative_limit
-        end_date = today
+        # configure start, end dates, up to the session the freshness check counts as done
+        end_date = self._last_session_close().normalize()
+        start_date = self.calendar.next(self._get_last_date_from_db(ticker, source))
+        if relative_limit is not None and start_date < end_date - relative_limit:
+            start_date = end_date - relative_limit
 
         # check date
         if start_date > end_date:
-            return
+            return None
+        return start_date, end_date
 
-        # download data and pre-process if needed
-        if source == "stooq":
-            data = StooqDailyReader(ticker + suffix, start_date, end_date).read()
-            if data.shape[0] == 0:
-                self._increment_trial_count(ticker, source)
-                return
-        else:
-            try:
+    @staticmethod
+    def _download(ticker, source, start_date, end_date):
+        """
+        download and pre-process bars, return None if the ticker is not available from the source
+        no database access so that it can run in worker threads
+        """
+        suffix, _, processor, reader = source_map[source]
+        try:
+            if reader is None:
                 data = web.DataReader(ticker + suffix, source, start_date, end_date)
-            except KeyError:
-                self._increment_trial_count(ticker, source)
-                return
+            else:
+                data = reader(ticker + suffix, start_date, end_date)
+        except KeyError:
+            return None
+
         if processor is not None:
             processor(data)
         data.index = data.index.astype("datetime64[ns]")  # for some sources, string can be return
+        return data
 
+    def _timed_download(self, ticker, source, start_date, end_date):
+        start = time.time()
+        data = self._download(ticker, source, start_date, end_date)
+        return data, time.time() - start
+
+    def _insert_bars(self, ticker, source, data):
+        """
+        insert downloaded bars without committing, return the first inserted date
+        """
         sdate, edate = parse_time(data.index.min()), parse_time(data.index.max())
         print(f"Downloaded {ticker} from {sdate.date()} to {edate.date()} totally {data.shape[0]:d} bars via {source}",
               flush=True)
-        data["source"] = source
-        data.to_sql(ticker, con=self.conn, index=True, index_label="date", if_exists="append")
+
+        bars = data.rename(str.lower, axis=1).reindex(["open", "high", "low", "close", "volume"], axis=1)
+        bars = bars.astype(object).where(bars.notna(), None)
+        bars.insert(0, "date", data.index.strftime("%Y-%m-%d %H:%M:%S"))
+        bars["source"] = source
+        self.conn.executemany(f"""
+            insert into {ticker} (date, open, high, low, close, volume, source)
+            values (?, ?, ?, ?, ?, ?, ?)
+        """, bars.itertuples(index=False))
+        self._merge_into_resolved_table(ticker, source, sdate)
+        return sdate
 
     def _read_ticker_from_db(self, ticker, start_date, end_date):
         if not isinstance(ticker, str):
             raise ValueError(f"ticker should be string instead of {type(ticker)}")
 
         stmt = f"""
-        with tmp as (
-            select a.*, b.rank 
-            from {ticker} a inner join SourceRank b 
-                on a.source = b.source
-        ) 
-        select a.date, a.open, a.high, a.low, a.close, a.volume
-        from tmp a 
-            inner join (
-                select date, min(rank) as rank 
-                from tmp 
-                where date between '{start_date}' and '{end_date}' 
-                group by date
-            ) b 
-            on a.date = b.date and a.rank = b.rank"""
-        return pd.read_sql(stmt, con=self.conn, index_col="date", parse_dates=["date"])
-
-    def _read_tickers_from_db(self, tickers, start_date, end_date):
-        data = [self._read_ticker_from_db(ticker, start_date, end_date) for ticker in tickers]
-        return pd.concat(data, axis=1, keys=tickers).reorder_levels([1, 0], axis=1).sort_index(axis=1)
+        select date, open, high, low, close, volume
+        from {ticker}_resolved
+        where date between ? and ?
+        order by date"""
+        return pd.read_sql(stmt, con=self.conn, params=(str(start_date), str(end_date)), index_col="date",
+                           parse_dates=["date"])
+
+    def _fill_panel_from_db(self, arrays, index, tickers, start_date, end_date, chunk=400):
+        """
+        one union query per chunk of tickers (sqlite caps compound selects at 500)
+        """
+        dtype = [('idx', 'int64'), ('date', 'datetime64[ns]')] + [(field, 'float64') for field in Panel.fields]
+        for offset in range(0, len(tickers), chunk):
+            stmt = "\nunion all\n".join(f"""
+                select {offset + idx} as idx, date, open, high, low, close, volume 
+                from {ticker}_resolved 
+                where date between ? and ?""" for idx, ticker in enumerate(tickers[offset:offset + chunk]))
+            params = [str(start_date), str(end_date)] * len(tickers[offset:offset + chunk])
+            rows = np.array(self.cur.execute(stmt, params).fetchall(), dtype=dtype)
+            self._fill_panel_column(arrays, index, rows['idx'], rows['date'].view('int64'),
+                                    [rows[field] for field in Panel.fields])
+
+    @staticmethod
+    def _fill_panel_column(arrays, index, columns, dates, values):
+        """
+        scatter bars into the preallocated panel arrays, dropping dates that are not on the calendar
+        """
+        rows = np.minimum(np.searchsorted(index, dates), max(index.shape[0] - 1, 0))
+        valid = index[rows] == dates if index.shape[0] > 0 else np.zeros(dates.shape[0], dtype=bool)
+        if not isinstance(columns, int):
+            columns = columns[valid]
+        for array, value in zip(arrays, values):
+            array[rows[valid], columns] = value[valid]
+
+    def _sync_column_store(self, ticker, first_new_date):
+        """
+        bring the columnar copy of a ticker up to date with sqlite
+        """
+        last_date = self.store.last_date(ticker)
+        if last_date is None or (first_new_date is not None and first_new_date <= last_date):
+            # empty store, or a source back-filled dates already resolved, so rebuild everything
+            self.store.rebuild(ticker, self._read_ticker_from_db(ticker, self.epoch, pd.Timestamp.today()))
+        elif first_new_date is not None:
+            self.store.append(ticker, self._read_ticker_from_db(ticker, last_date + pd.Timedelta(1, 'ns'),
+                                                                pd.Timestamp.today()))
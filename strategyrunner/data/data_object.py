@@ -5,43 +5,29 @@ import zmq
 import zmq.asyncio as zmqa
 import pandas as pd
 import numpy as np
-from typing import Type
-import struct
+from typing import Type, Union
 import asyncio
-
+import collections
+import time
+import json
+
+from .panel import Panel
+from .bar_aggregator import BarAggregator, CompletedBar
+from .ring_buffer import RingBuffer
+from .snapshot import decode_snapshot, SequenceTracker, feed_topic
+from .shared_panel import attach_panel
 from ..async_agent import AsyncAgent
-from ..event import QuoteEvent
+from ..event import QuoteEvent, QuoteBlockEvent, FeedStatusEvent
+from ..helpers import TickerIndex, SparseVector
 from .. import const
 from .. import utils
 
 
-class Bar:
-    def __init__(self):
-        self.open = None
-        self.high = None
-        self.low = None
-        self.close = None
-
-    def add(self, price):
-        if self.open is None:
-            self.open = price
-        self.high = max(self.high, price) if self.high is not None else price
-        self.low = min(self.low, price) if self.low is not None else price
-        self.close = price
-
-    def get(self):
-        tmp = [self.open, self.high, self.low, self.close].copy()
-        self.open = None
-        self.high = None
-        self.low = None
-        self.close = None
-        return tmp
-
-
 class DataObject(ABC):
     def __init__(self, data_type: const.Data, broker: const.Broker, tickers, *args):
         super().__init__(*args)  # for multiple inheritance
-        self.tickers = tickers
+        self.index = TickerIndex(tickers)  # shared with signals and the trade record
+        self.tickers = self.index.tickers
 
         self.type = data_type  # type: const.Data
         self.broker = broker  # type: const.Broker
@@ -50,7 +36,7 @@ class DataObject(ABC):
         self.high = None
         self.low = None
         self.close = None
-        self.current_close = None
+        self.current_close = None  # last close in ticker index order
 
         self._now = None
         self.sid = ''
@@ -82,6 +68,13 @@ class DataObject(ABC):
     def now(self):
         return self._now
 
+    @property
+    def next_timestamp(self):
+        """
+        timestamp of the next bar, None if it isn't known
+        """
+        return None
+
 
 class Dispatcher:
     def __init__(self, data_class: Type[DataObject], tickers: list, data=None):
@@ -92,32 +85,160 @@ class Dispatcher:
         self.data_class = data_class
         self.tickers = tickers
         self.data = data
+        self.segment = None  # name of the shared memory segment holding the data, if any
+        self.stream = None  # id of the server stream delivering the data in chunks, if any
 
-    def dispatch(self):
+    def to_frames(self, segment=None):
+        """
+        multipart message of a small json header followed by one raw buffer per array, so that the receiver can
+        wrap the buffers without copying and intermediaries can forward the frames without decoding them
+        segment is the (name, layout) of a shared memory copy of the data, in which case only the header is sent
+        """
+        header = {'class': self.data_class.__name__, 'tickers': self.tickers}
+        if self.data is None:
+            return [json.dumps(header).encode()]
+
+        if segment is not None:
+            header['columns'] = self.data.tickers
+            header['segment'], header['layout'] = segment
+            return [json.dumps(header).encode()]
+
+        panel = self.data if isinstance(self.data, Panel) else Panel.from_frame(self.data)
+        arrays = [('index', panel.index)] + [(field, getattr(panel, field)) for field in Panel.fields
+                                             if getattr(panel, field) is not None]
+        arrays = [(name, np.ascontiguousarray(array)) for name, array in arrays]
+        header['columns'] = panel.tickers
+        header['rows'] = len(panel)
+        header['arrays'] = [[name, array.dtype.str] for name, array in arrays]
+        return [json.dumps(header).encode()] + [array for _, array in arrays]
+
+    @staticmethod
+    def stream_frames(tickers, index, stream):
+        """
+        first message of a streamed historical data object, only the dates are sent and the bars follow in chunks
+        """
+        index = np.ascontiguousarray(index, dtype='int64')
+        header = {'class': HistoricalDataObject.__name__, 'tickers': tickers, 'columns': tickers,
+                  'rows': len(index), 'stream': stream, 'arrays': [['index', index.dtype.str]]}
+        return [json.dumps(header).encode(), index]
+
+    @staticmethod
+    def chunk_frames(stream, offset, panel: Panel, last):
+        """
+        bars of rows [offset, offset + len(panel)) of a stream, panel is None for an empty chunk
+        """
+        header = {'stream': stream, 'offset': offset, 'rows': 0, 'last': last, 'arrays': []}
+        if panel is None:
+            return [json.dumps(header).encode()]
+
+        arrays = [(field, np.ascontiguousarray(getattr(panel, field))) for field in Panel.fields
+                  if getattr(panel, field) is not None]
+        header['rows'] = len(panel)
+        header['arrays'] = [[name, array.dtype.str] for name, array in arrays]
+        return [json.dumps(header).encode()] + [array for _, array in arrays]
+
+    @staticmethod
+    def error_frames(message):
+        return [json.dumps({'error': message}).encode()]
+
+    @staticmethod
+    def read_chunk(frames):
+        """
+        return the chunk header and its (rows x ticker) arrays by field
+        """
+        buffers = [frame.buffer if isinstance(frame, zmq.Frame) else frame for frame in frames]
+        header = Dispatcher._read_header(buffers[0])
+        arrays = {name: np.frombuffer(buffer, dtype=dtype).reshape(header['rows'], -1)
+                  for (name, dtype), buffer in zip(header['arrays'], buffers[1:])}
+        return header, arrays
+
+    @staticmethod
+    def _read_header(buffer):
+        header = json.loads(bytes(buffer))
+        if 'error' in header:
+            raise ValueError(header['error'])
+        return header
+
+    @classmethod
+    def from_frames(cls, frames):
+        """
+        frames can be bytes or zmq.Frame received with copy=False, arrays are read-only views on them
+        """
+        buffers = [frame.buffer if isinstance(frame, zmq.Frame) else frame for frame in frames]
+        header = cls._read_header(buffers[0])
+        data_class = {klass.__name__: klass for klass in (HistoricalDataObject, RealTimeDataObject)}[header['class']]
+        if 'segment' in header:
+            dispatcher = cls(data_class, header['tickers'],
+                             data=attach_panel(header['columns'], header['segment'], header['layout']))
+            dispatcher.segment = header['segment']
+            return dispatcher
+        if 'arrays' not in header:
+            return cls(data_class, header['tickers'])
+
+        shape = (header['rows'], len(header['columns']))
+        arrays = {}
+        for (name, dtype), buffer in zip(header['arrays'], buffers[1:]):
+            array = np.frombuffer(buffer, dtype=dtype)
+            arrays[name] = array if name == 'index' else array.reshape(shape)
+        if 'stream' in header:
+            # writable placeholders that the chunks are copied into as they arrive
+            panel = Panel(header['columns'], arrays['index'], *[np.full(shape, np.nan) for _ in Panel.fields])
+            dispatcher = cls(data_class, header['tickers'], data=panel)
+            dispatcher.stream = header['stream']
+            return dispatcher
+        panel = Panel(header['columns'], arrays['index'], *[arrays.get(field) for field in Panel.fields])
+        return cls(data_class, header['tickers'], data=panel)
+
+    def dispatch(self, own_loop=True):
+        """
+        own_loop is False when the data object is built inside a running event loop, which then runs it
+        """
         if self.data_class is HistoricalDataObject:
-            return self.data_class(self.tickers, self.data)
+            return self.data_class(self.tickers, self.data, loaded_rows=0 if self.stream is not None else None)
         elif self.data_class is RealTimeDataObject:
-            return self.data_class(self.tickers)
+            return self.data_class(self.tickers, own_loop=own_loop)
         else:
             raise ValueError('Unrecognized data object class')
 
 
 class HistoricalDataObject(DataObject):
-    def __init__(self, tickers, data: pd.DataFrame):
+    def __init__(self, tickers, data: Union[pd.DataFrame, Panel], loaded_rows=None):
+        """
+        loaded_rows is the number of bars already in data when the rest is streamed in with add_chunk
+        """
         super(HistoricalDataObject, self).__init__(const.Data.SIMULATED, const.Broker.SIMULATED, tickers)
 
-        self.__data = data
+        # panel arrays are wrapped as they are, so memory-mapped columns are not copied
+        self.__data = data if isinstance(data, Panel) else Panel.from_frame(data)
         self.index_row = 0
         self.prev_row = 0
-        self.last_row = self.__data.shape[0]
-
-        # since loc in this case returns copy, we do indexing once and for all to avoid overhead
-        self.tickers = self.__data.close.columns.tolist()  # update tickers to ensure order
-        self.__open = self.__data.open.values
-        self.__high = self.__data.high.values
-        self.__low = self.__data.low.values
-        self.__close = self.__data.close.values
-        self.__timestamps = self.__data.index.tolist()
+        self.last_row = len(self.__data)
+        self.loaded_row = self.last_row if loaded_rows is None else loaded_rows
+        self.feed = None  # callable returning the frames of the next chunk
+
+        self.index = TickerIndex(self.__data.tickers)  # update tickers to ensure order
+        self.tickers = self.index.tickers
+        self.__open = self.__data.open
+        self.__high = self.__data.high
+        self.__low = self.__data.low
+        self.__close = self.__data.close
+        self.__timestamps = self.__data.timestamps.tolist()
+
+    def set_feed(self, feed):
+        self.feed = feed
+
+    def add_chunk(self, frames):
+        """
+        copy a streamed chunk into place, return True if it is the last one
+        """
+        header, arrays = Dispatcher.read_chunk(frames)
+        rows = slice(header['offset'], header['offset'] + header['rows'])
+        for field, array in arrays.items():
+            getattr(self.__data, field)[rows] = array
+        self.loaded_row = max(self.loaded_row, rows.stop)
+        if header['last']:
+            self.loaded_row = self.last_row
+        return header['last']
 
     def update_bar(self):
         # end of data
@@ -125,26 +246,44 @@ class HistoricalDataObject(DataObject):
             return False
 
         self.index_row += 1
+        self._wait_for_rows(self.index_row)
         self._update_bar()
         return True
 
     def set_look_back(self, period=0):
         if self.index_row < period:
             self.index_row = period  # set start point to lookback period
+        self._wait_for_rows(self.index_row)
         self._update_bar()
 
     async def set_time(self, timestamp):
-        while self.index_row < self.last_row and timestamp >= self.__timestamps[self.index_row]:
+        timestamps, prices = self.advance(timestamp)
+        self._update_bar()
+        if len(timestamps) > 0:
+            await self.queue.put(QuoteBlockEvent(self.sid, timestamps, prices))
+
+    def advance(self, timestamp):
+        """
+        move past the loaded bars up to timestamp, return the quote block of the bars passed since the last call
+        """
+        while self.index_row < self.loaded_row and timestamp >= self.__timestamps[self.index_row]:
             self.index_row += 1
-        await self._update_and_quote()
+        block = self.quote_block(self.prev_row, self.index_row)
+        self.prev_row = self.index_row
+        return block
+
+    @property
+    def next_timestamp(self):
+        if self.index_row >= self.last_row:
+            return None
+        return self.__timestamps[self.index_row]
 
     def get_close(self, ticker):
-        return self.current_close[ticker]
+        return self.current_close[self.index[ticker]]
 
-    async def _update_and_quote(self):
-        self._update_bar()
-        await self.send_quotes()
-        self.prev_row = self.index_row
+    def _wait_for_rows(self, rows):
+        while self.loaded_row < rows and self.feed is not None:
+            self.add_chunk(self.feed())
 
     def _update_bar(self):
         self._now = self.__timestamps[self.index_row - 1]
@@ -152,78 +291,159 @@ class HistoricalDataObject(DataObject):
         self.high = self.__high[:self.index_row]
         self.low = self.__low[:self.index_row]
         self.close = self.__close[:self.index_row]
-        self.current_close = {ticker: price for ticker, price in zip(self.tickers, self.close[-1])}
+        self.current_close = self.close[-1]
 
-    async def send_quotes(self):
-        for idx in range(self.prev_row, self.index_row):
-            await self.queue.put(QuoteEvent(self.__timestamps[idx], self.sid,
-                                            {ticker: price for ticker, price in zip(self.tickers, self.close[idx])}))
+    def quote_block(self, start_row, end_row):
+        """
+        (timestamps, closes) of rows [start_row, end_row), the closes are a view
+        """
+        return self.__timestamps[start_row:end_row], self.__close[start_row:end_row]
 
 
 class RealTimeDataObject(DataObject, AsyncAgent):
-    def __init__(self, tickers, data=None):
-        super(RealTimeDataObject, self).__init__(tickers)
+    max_batch = 1000  # ticks drained from the socket per aggregator update
+
+    def __init__(self, tickers, data=None, own_loop=True):
+        """
+        with own_loop the data object runs its event loop in a thread of its own and bars are taken with
+        update_bar, otherwise it runs on the caller's loop and current_close follows the latest bars
+        """
+        super(RealTimeDataObject, self).__init__(const.Data.REALTIME, const.Broker.INTERACTIVE_BROKERS, tickers)
 
-        self.bars = {ticker: Bar() for ticker in tickers}
+        config = utils.load_config()
+        # bars of the first resolution drive update_bar, the latest bar of every resolution is kept in bars
+        self.aggregator = BarAggregator(tickers, config.get('real_time_bar_seconds', [5]))
+        self.bars = {}  # type: dict[float, CompletedBar]
+        self.completed = collections.deque()  # bars of the first resolution not yet taken by update_bar
         self.data_ready = threading.Event()
         self.agent_close = threading.Event()
         self.events = [self.data_ready, self.agent_close]
+        self.own_loop = own_loop
         self.look_back = None
+        self.__windows = None  # type: list[RingBuffer]
+        self.set_look_back(0)
+
+        # snapshots of all the tickers come on one topic, records give tickers by their column
+        self.topic = feed_topic(tickers)
+        self.sequences = SequenceTracker()
+        self.conflate = config.get('subscriber_conflate', False)  # keep only the latest tick of each ticker
+        # a drain is capped so that a publisher outpacing the subscriber can't keep it from yielding
+        self.max_drain = config.get('subscriber_hwm', 1000) if self.conflate else self.max_batch
+        self.conflated = 0
+        self.lag = 0.0  # seconds between the oldest tick of the last batch and its arrival
+        self.rate = utils.RateMeter()
+        self.quoted = np.full(len(self.tickers), np.nan)  # closes last sent to the account
 
-        self.__open = []
-        self.__high = []
-        self.__low = []
-        self.__close = []
-        self.__prices = [self.__open, self.__high, self.__low, self.__close]
-
-        config = utils.load_config()
         self.socket = zmqa.Context().socket(zmq.SUB)
+        self.socket.setsockopt(zmq.RCVHWM, config.get('subscriber_hwm', 1000))
         # sub needs to subscribe to topic
-        for ticker in tickers:
-            self.socket.setsockopt(zmq.SUBSCRIBE, ticker.encode())
+        self.socket.setsockopt(zmq.SUBSCRIBE, self.topic)
         self.socket.connect(f'tcp://127.0.0.1:{config["data_server_broadcast_port"]}')
-        self.run_in_fork()
 
-    def _run(self):
-        return [
-            [self.collect_data, '']
-        ]
+        # feed health goes back to the data server so that it can tell which subscriber is lagging
+        self.status_interval = config.get('feed_status_interval', 10)
+        self.status_socket = zmqa.Context().socket(zmq.REQ)
+        self.status_socket.connect(f'tcp://127.0.0.1:{config["data_server_request_port"]}')
+
+        self.run_coroutine('', self.collect_data)
+        self.run_coroutine('', self.close_bars)
+        self.run_coroutine('', self.report_status)
+        if own_loop:
+            self.run_in_fork()
 
     def set_look_back(self, period=0):
+        """
+        open, high, low and close are views on ring buffers holding the last period bars
+        """
         self.look_back = period
+        self.__windows = [RingBuffer(period, len(self.tickers)) for _ in range(4)]
 
     def update_bar(self):
-        self.data_ready.wait()
-        self.data_ready.clear()
+        while len(self.completed) == 0 and not self.agent_close.is_set():
+            self.data_ready.wait()
+            self.data_ready.clear()
 
         # data_ready can be set because of agent shutdown, need to check specifically
         if not self.agent_close.is_set():
-            ohlc = [self.bars[ticker].get() for ticker in self.tickers]
-            ohlc = list(map(list, zip(*ohlc)))  # transpose
-            for datum, price in zip(self.__prices, ohlc):
-                if len(datum) >= self.look_back:
-                    datum.pop(0)
-                datum.append(price)
-
-            self.open = np.array(self.__open)
-            self.high = np.array(self.__high)
-            self.low = np.array(self.__low)
-            self.close = np.array(self.__close)
+            bar = self.completed.popleft()  # type: CompletedBar
+            self._now = bar.timestamp
+            for window, price in zip(self.__windows, [bar.open, bar.high, bar.low, bar.close]):
+                window.append(price)
+
+            self.open, self.high, self.low, self.close = [window.view() for window in self.__windows]
+            self.current_close = bar.close
             return True
         return False
 
     def get_close(self, ticker):
-        pass
+        return self.current_close[self.index[ticker]]
 
     async def collect_data(self):
-        [ticker, msg] = await self.socket.recv_multipart()
-        ticker = ticker.decode()
-        timestamp, price = struct.unpack('if', msg)
-        print(timestamp, price)
-        self.bars[ticker].add(price)
-
-        if timestamp % 5 == 0:
-            self.data_ready.set()
+        # drain what has queued up so that the aggregator is updated once per batch, when conflating up to a
+        # queue's worth is drained and only the latest tick of each ticker is kept
+        messages = [await self.socket.recv_multipart()]
+        while len(messages) < self.max_drain:
+            try:
+                messages.append(await self.socket.recv_multipart(flags=zmq.NOBLOCK))
+            except zmq.Again:
+                break
+
+        batch = []
+        for topic, payload in messages:
+            seq, records = decode_snapshot(payload)
+            missed = self.sequences.check(topic, seq)
+            if missed > 0:
+                print(f'Missed {missed} snapshots ({self.sequences})')
+            batch.append(records)
+        records = np.concatenate(batch) if len(batch) > 1 else batch[0]
+        if self.conflate:
+            _, last = np.unique(records['column'][::-1], return_index=True)
+            self.conflated += records.shape[0] - last.shape[0]
+            records = records[np.sort(records.shape[0] - 1 - last)]
+        self.rate.add(records.shape[0])
+        if records.shape[0] > 0:
+            self.lag = (time.time_ns() - records['timestamp'].min()) / 1e9
+
+        await self._publish(self.aggregator.add(records['column'], records['price'], records['size'],
+                                                records['timestamp']))
+        return True
+
+    async def close_bars(self):
+        """
+        close bars on the wall clock even when no tick arrives
+        """
+        next_end = self.aggregator.next_end()
+        if next_end is None:
+            await asyncio.sleep(self.aggregator.resolutions[0])
+        else:
+            await asyncio.sleep(max(next_end - time.time_ns(), 0) / 1e9)
+        await self._publish(self.aggregator.advance())
+        return True
+
+    async def report_status(self):
+        await asyncio.sleep(self.status_interval)
+        await self.status_socket.send_pyobj(FeedStatusEvent(self.sid, self.sequences.received, self.sequences.gaps,
+                                                            self.sequences.missed, self.conflated, self.lag,
+                                                            self.rate.reset()))
+        await self.status_socket.recv_multipart()
+        return True
+
+    async def _publish(self, completed):
+        for bar in completed:
+            self.bars[bar.resolution] = bar
+            if bar.resolution != self.aggregator.resolutions[0]:
+                continue
+
+            if self.own_loop:
+                self.completed.append(bar)
+                self.data_ready.set()
+            else:
+                # nothing takes bars with update_bar, orders are sized and filled at the latest closes, which
+                # bars carry forward for tickers without ticks
+                self._now = bar.timestamp
+                self.current_close = bar.close
             if self.queue is not None:
-                await self.queue.put(QuoteEvent(timestamp,
-                                                {ticker: self.bars[ticker].close for ticker in self.tickers}))
+                positions = np.flatnonzero((bar.close != self.quoted) & ~np.isnan(bar.close))
+                self.quoted[positions] = bar.close[positions]
+                await self.queue.put(QuoteEvent(bar.timestamp, self.sid, SparseVector.from_dense(
+                    self.index, bar.close, positions)))
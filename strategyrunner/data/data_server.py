@@ -5,11 +5,21 @@ import asyncio
 from concurrent import futures
 import pickle
 import os
-import struct
+import time
+import threading
+import numpy as np
+import pandas as pd
+from typing import List
 
 from ..async_agent import AsyncAgent
-from ..data import DataManager, HistoricalDataObject, RealTimeDataObject, Dispatcher
-from ..event import DataRequestEvent
+from ..data import DataManager, HistoricalDataObject, RealTimeDataObject, Dispatcher, Panel
+from .panel_cache import PanelCache
+from .shared_panel import SharedPanelRegistry
+from .admission import AdmissionController
+from .snapshot import encode_snapshot, feed_topic, topic_name, header as snapshot_header
+from .journal import JournalWriter, JournalReader
+from .feed import make_feed
+from ..event import DataRequestEvent, DataChunkEvent, FeedStatusEvent
 from ..logger import Logger
 from .. import utils
 from .. import const
@@ -38,6 +48,45 @@ class RealTimeDataRequest(Request):
         return f'Request {", ".join(self.tickers)} real-time data'
 
 
+class InFlightLoad:
+    """
+    historical load submitted to the executor that concurrent requests can wait on
+    """
+    def __init__(self, tickers, start_date, end_date, future: asyncio.Future):
+        self.tickers = set(tickers)
+        self.start_date = pd.Timestamp(start_date)
+        self.end_date = pd.Timestamp(end_date)
+        self.future = future
+
+    def covers(self, tickers, start_date, end_date):
+        return set(tickers) <= self.tickers and self.start_date <= pd.Timestamp(start_date) \
+            and self.end_date >= pd.Timestamp(end_date)
+
+    def overlaps(self, tickers, start_date, end_date):
+        return len(set(tickers) & self.tickers) > 0 and self.start_date <= pd.Timestamp(end_date) \
+            and self.end_date >= pd.Timestamp(start_date)
+
+
+class DataStream:
+    """
+    historical data sent in chunks of bars, each chunk is loaded only when the client asks for it
+    """
+    def __init__(self, stream_id, tickers, dates, chunk_size, nbytes):
+        self.id = stream_id
+        self.tickers = tickers
+        self.dates = dates  # int64 ns calendar dates of the whole request
+        self.chunk_size = chunk_size
+        self.nbytes = nbytes  # memory reserved for one chunk
+        self.offset = 0
+        self.last_used = time.time()  # streams left idle for too long are taken as abandoned
+
+    def __str__(self):
+        return f'Stream {self.id} at {self.offset} of {len(self.dates)} bars for {", ".join(self.tickers)}'
+
+    def __repr__(self):
+        return self.__str__()
+
+
 class DataServer(AsyncAgent):
     def __init__(self, config_file=None):
         super().__init__()
@@ -48,51 +97,361 @@ class DataServer(AsyncAgent):
         self.request_port = config['data_server_request_port']
         self.pub_port = config['data_server_broadcast_port']
         self.db_dir = f'{os.getcwd()}/data/test.db'
+        self.column_dir = config.get('column_store_dir')
+        self.update_workers = config.get('data_update_workers')
 
         self.socket = zmqa.Context().socket(zmq.ROUTER)
         self.socket.bind(f'tcp://127.0.0.1:{self.request_port}')
-        self.broadcast_socket = zmqa.Context().socket(zmq.PUB)
+        self.broadcast_socket = zmqa.Context().socket(zmq.XPUB)
+        # a subscriber past the high-water mark loses messages instead of holding up the others
+        self.broadcast_socket.setsockopt(zmq.SNDHWM, config.get('broadcast_hwm', 1000))
+        self.broadcast_interval = config.get('broadcast_interval', 1)
         self.broadcast_socket.bind(f'tcp://127.0.0.1:{self.pub_port}')
 
+        # one writer shared under a lock and one read-only connection per executor thread, all set up once here
         self.executor = futures.ThreadPoolExecutor(max_workers=10)
-        self.tickers = set()
-        self.counter = 0
+        self.writer = DataManager(self.db_dir, self.column_dir).open(check_same_thread=False)
+        self.write_lock = threading.Lock()
+        self.readers = threading.local()
+        self.cache = PanelCache(config.get('data_cache_bytes', 2 ** 29))
+        self.inflight = []  # type: List[InFlightLoad]
+        self.coalesced = 0
+        self.shared = SharedPanelRegistry() if config.get('data_shared_memory') else None
+        self.admission = AdmissionController(config.get('data_memory_budget', 2 ** 30),
+                                             config.get('data_max_queued_requests', 32))
+        self.streams = {}  # type: dict[int, DataStream]
+        self.stream_count = 0
+        self.stream_timeout = config.get('data_stream_timeout', 300)
+        # topic -> tickers of every real-time data object handed out
+        self.feeds = {}  # type: dict[bytes, list]
+        self.subscribed = set()  # topics with at least one subscriber
+        self.feed = make_feed(config.get('feed')) if not config.get('replay_file') else None
+        self.feed_clock = time.time_ns()  # end of the last round generated by the feed
+        self.feed_reported = 0  # ticks generated by the feed as of the last rate report
+        self.sequences = {}  # topic -> last sequence number sent
+        # latest feed health of every subscriber since the last rate report
+        self.feed_status = {}  # type: dict[str, FeedStatusEvent]
+
+        # everything broadcast can be recorded to a journal, and a journal can be replayed instead of the feed
+        self.journal = JournalWriter(config['journal_file']) if config.get('journal_file') else None
+        self.rate = utils.RateMeter()
+        self.rate_interval = config.get('rate_report_interval', 10)
 
         self.run_coroutine(f'Listening on port {self.request_port}', self.handle_data_request)
-        self.run_coroutine(f'Broadcasting started on port {self.pub_port}', self.broadcast_data)
+        if config.get('replay_file'):
+            self.run_coroutine(f'Replaying {config["replay_file"]} on port {self.pub_port}', self.replay,
+                               config['replay_file'], config.get('replay_speed', 1))
+        else:
+            self.run_coroutine(f'Broadcasting started on port {self.pub_port}', self.broadcast_data)
+        self.run_coroutine('', self.handle_subscriptions)
+        self.run_coroutine('', self.report_rate)
+        self.run_coroutine('', self.expire_streams)
 
     async def handle_data_request(self):
         pid, _, request = await self.socket.recv_multipart()
         event = pickle.loads(request)
         self.logger.log_info(f'Request received from {pid}: {event}')
+        if event.type == const.Event.DATA_RELEASE:
+            if event.segment is not None and self.shared is not None:
+                self.shared.release(event.segment)
+                self.logger.log_info(f'{len(self.shared)} shared segments / {self.shared.nbytes / 2 ** 20:.1f}MB '
+                                     f'in use')
+            if event.stream is not None:
+                await self.close_stream(event.stream, 'abandoned')
+            await self.socket.send_multipart([pid, b'', b''])
+            return True
+
+        if event.type == const.Event.FEED_STATUS:
+            self.feed_status[event.sid or pid.hex()] = event
+            if event.missed > 0 or event.lag > self.broadcast_interval:
+                self.logger.log_info(f'Lagging subscriber: {event}')
+            await self.socket.send_multipart([pid, b'', b''])
+            return True
+
+        if event.type == const.Event.DATA_CHUNK:
+            self.run_coroutine('', self.send_chunk, pid, event)
+            return True
+
         self.run_coroutine('', self.send_data_obj, pid, event)
         return True
 
     async def send_data_obj(self, cid: bytes, event: DataRequestEvent):
         if event.broker == const.Broker.SIMULATED:  # historical data
+            if event.chunk_size:
+                await self.start_stream(cid, event)
+                return
+
             self.logger.log_info(f'Loading data for {event.tickers} from {event.start_time} to {event.end_time}')
-            data = await self.loop.run_in_executor(self.executor, self.retrieve_data_from_db,
-                                                   event.tickers, event.start_time, event.end_time)
-            data_obj = Dispatcher(HistoricalDataObject, event.tickers, data=data)
+            nbytes = self.estimate_bytes(event.tickers, event.start_time, event.end_time)
+            try:
+                await self.admission.acquire(nbytes)
+            except ValueError as e:
+                await self.send_error(cid, e)
+                return
+
+            try:
+                data = await self.load_historical_data(event.tickers, event.start_time, event.end_time)
+                data_obj = Dispatcher(HistoricalDataObject, event.tickers, data=data)
+                if self.shared is not None:
+                    # same-host clients map one copy of the panel instead of receiving their own
+                    key = (tuple(event.tickers), str(event.start_time), str(event.end_time))
+                    await self.socket.send_multipart([cid, b''] + data_obj.to_frames(self.shared.publish(key, data)))
+                    self.logger.log_info('Shared data object sent')
+                else:
+                    await self.socket.send_multipart([cid, b''] + data_obj.to_frames(), copy=False)
+                    self.logger.log_info('Data object sent')
+            except Exception as e:
+                # the client waits on its reply, so a failed load is answered instead of dropped
+                await self.send_error(cid, e)
+            finally:
+                await self.admission.release(nbytes)
+            return
 
         elif event.broker == const.Broker.INTERACTIVE_BROKERS:  # IB real time data
-            self.tickers |= set(event.tickers)
-            self.logger.log_info(f'Enlisted tickers: {self.tickers}')
+            # the data object subscribes to the topic of its tickers, which are then broadcast in one frame
+            self.feeds[feed_topic(event.tickers)] = list(event.tickers)
             data_obj = Dispatcher(RealTimeDataObject, event.tickers)
 
         else:
             raise ValueError('Unrecognized request')
-        await self.socket.send_multipart([cid, b'', pickle.dumps(data_obj)])
+        await self.socket.send_multipart([cid, b''] + data_obj.to_frames(), copy=False)
         self.logger.log_info('Data object sent')
 
+    async def start_stream(self, cid: bytes, event: DataRequestEvent):
+        """
+        reply with the dates only, memory for one chunk stays reserved until the last chunk is sent
+        """
+        try:
+            await self.loop.run_in_executor(self.executor, self.update_tickers, event.tickers)
+            dates = self.writer.calendar.between(event.start_time, min(pd.Timestamp(event.end_time),
+                                                                       pd.Timestamp.today().normalize()))
+        except Exception as e:
+            await self.send_error(cid, e)
+            return
+
+        if len(dates) == 0:
+            await self.socket.send_multipart([cid, b''] + Dispatcher.stream_frames(event.tickers, dates, None))
+            return
+
+        chunk_size = max(int(event.chunk_size), 1)
+        nbytes = self.estimate_bytes(event.tickers, rows=min(chunk_size, len(dates)))
+        try:
+            await self.admission.acquire(nbytes)
+        except ValueError as e:
+            await self.send_error(cid, e)
+            return
+
+        self.stream_count += 1
+        stream = DataStream(self.stream_count, event.tickers, dates, chunk_size, nbytes)
+        self.streams[stream.id] = stream
+        self.logger.log_info(f'{stream} opened / {self.admission}')
+        await self.socket.send_multipart([cid, b''] + Dispatcher.stream_frames(event.tickers, dates, stream.id),
+                                         copy=False)
+
+    async def send_chunk(self, cid: bytes, event: DataChunkEvent):
+        stream = self.streams.get(event.stream)
+        if stream is None:
+            await self.send_error(cid, ValueError(f'Data stream {event.stream} does not exist'))
+            return
+
+        stream.last_used = time.time()
+        lo = stream.offset
+        hi = min(lo + stream.chunk_size, len(stream.dates))
+        panel = None
+        try:
+            if hi > lo:
+                panel = await self.loop.run_in_executor(self.executor, self.read_chunk, stream.tickers,
+                                                        stream.dates[lo], stream.dates[hi - 1])
+        except Exception as e:
+            await self.close_stream(stream.id, 'failed')
+            await self.send_error(cid, e)
+            return
+
+        stream.offset = hi
+        last = hi >= len(stream.dates)
+        if last:
+            await self.close_stream(stream.id, 'finished')
+        await self.socket.send_multipart([cid, b''] + Dispatcher.chunk_frames(stream.id, lo, panel, last), copy=False)
+
+    async def close_stream(self, stream_id, reason):
+        """
+        drop the stream and give its memory reservation back, whether it was read to the end or not
+        """
+        stream = self.streams.pop(stream_id, None)
+        if stream is None:
+            return
+        await self.admission.release(stream.nbytes)
+        self.logger.log_info(f'{stream} {reason} / {self.admission}')
+
+    async def expire_streams(self):
+        await asyncio.sleep(self.stream_timeout / 2)
+        now = time.time()
+        for stream in [stream for stream in self.streams.values() if now - stream.last_used > self.stream_timeout]:
+            await self.close_stream(stream.id, 'expired')
+        return True
+
+    async def send_error(self, cid: bytes, error: Exception):
+        self.logger.log_info(f'Request rejected: {error}')
+        await self.socket.send_multipart([cid, b''] + Dispatcher.error_frames(str(error)))
+
+    def estimate_bytes(self, tickers, start_date=None, end_date=None, rows=None):
+        """
+        size of the float64 fields and int64 dates of a panel
+        """
+        if rows is None:
+            end_date = min(pd.Timestamp(end_date), pd.Timestamp.today().normalize())
+            rows = len(self.writer.calendar.between(start_date, end_date))
+        return rows * (len(tickers) * len(Panel.fields) + 1) * 8
+
     async def broadcast_data(self):
-        self.counter += 1
-        for ticker in self.tickers:
-            await self.broadcast_socket.send_multipart([ticker.encode(), struct.pack('if', *[self.counter, self.counter])])
-        await asyncio.sleep(1)
+        start, self.feed_clock = self.feed_clock, time.time_ns()
+        # nothing is produced for tickers without subscribers
+        tickers = sorted(set().union(*[self.feeds[topic] for topic in self.subscribed]))
+        columns, timestamps, prices, sizes = self.feed.generate(tickers, start, self.feed_clock,
+                                                                self.broadcast_interval)
+
+        # one snapshot per topic holding all ticks of its tickers of the round
+        positions = {ticker: column for column, ticker in enumerate(tickers)}
+        for topic in sorted(self.subscribed):
+            feed_columns = np.full(len(tickers), -1)
+            feed_columns[[positions[ticker] for ticker in self.feeds[topic]]] = np.arange(len(self.feeds[topic]))
+            mapped = feed_columns[columns]
+            rows = np.flatnonzero(mapped >= 0)
+            if rows.shape[0] == 0:
+                continue
+            seq = self.sequences.get(topic, 0) + 1
+            self.sequences[topic] = seq
+            payload = encode_snapshot(seq, mapped[rows], timestamps[rows], prices[rows], sizes[rows])
+            await self.publish(topic, payload)
+
+        # the next round starts one interval after this one started, less the time spent generating
+        await asyncio.sleep(max(self.broadcast_interval - (time.time_ns() - self.feed_clock) / 1e9, 0))
         return True
 
+    async def publish(self, topic, payload, record=True):
+        await self.broadcast_socket.send_multipart([topic, payload])
+        if record and self.journal is not None:
+            self.journal.write(topic, payload)
+        self.rate.add(snapshot_header.unpack_from(payload)[1])
+
+    async def replay(self, journal_file, speed=1):
+        """
+        publish a journal with its recorded timing scaled by speed, as fast as possible if speed is 0
+        """
+        first, start = None, time.perf_counter()
+        for count, (timestamp, topic, payload) in enumerate(JournalReader(journal_file)):
+            first = timestamp if first is None else first
+            if speed > 0:
+                delay = (timestamp - first) / 1e9 / speed - (time.perf_counter() - start)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            elif count % 1000 == 0:
+                await asyncio.sleep(0)  # let requests through
+            await self.publish(topic, payload, record=False)
+
+        elapsed = time.perf_counter() - start
+        self.logger.log_info(f'Replay of {journal_file} finished, {self.rate.total} ticks in {elapsed:.2f}s '
+                             f'({self.rate.total / max(elapsed, 1e-9):.0f} ticks/s)')
+        return False
+
+    async def shutdown(self):
+        # ticks of the last partial interval are only flushed by closing the journal
+        if self.journal is not None:
+            self.journal.close()
+            print(f'{self.journal} closed')  # the logger is stopped with the loop
+            self.journal = None
+        await super(DataServer, self).shutdown()
+
+    async def report_rate(self):
+        await asyncio.sleep(self.rate_interval)
+        if self.journal is not None:
+            self.journal.flush()
+        if self.rate.count > 0 and self.feed is None:
+            self.logger.log_info(f'Replayed {self.rate.reset():.0f} ticks/s ({self.rate.total} in total)')
+        elif self.rate.count > 0:
+            # bursts push the generated rate above the requested one, falling behind shows as broadcast < generated
+            generated = (self.feed.generated - self.feed_reported) / self.rate.elapsed()
+            requested = f', {self.feed.rate} requested' if self.feed.rate is not None else ''
+            self.logger.log_info(f'Broadcast {self.rate.reset():.0f} ticks/s of {generated:.0f} generated{requested} '
+                                 f'({self.rate.total} in total)')
+            self.feed_reported = self.feed.generated
+
+        # lag and drop counters of every subscriber that reported since the last interval
+        for status in self.feed_status.values():
+            self.logger.log_info(str(status))
+        self.feed_status.clear()
+        return True
+
+    async def handle_subscriptions(self):
+        """
+        xpub passes on the first subscription and the last unsubscription of every topic
+        """
+        msg = await self.broadcast_socket.recv()
+        topic = bytes(msg[1:])
+        if msg[0] != 1:
+            self.subscribed.discard(topic)
+        elif topic in self.feeds:
+            self.subscribed.add(topic)
+        else:
+            self.logger.log_info(f'Subscription to unknown topic {topic_name(topic)} ignored')
+            return True
+        tickers = sorted(set().union(*[self.feeds[topic] for topic in self.subscribed]))
+        self.logger.log_info(f'Subscribed tickers: {", ".join(tickers)}')
+        return True
+
+    async def load_historical_data(self, tickers, start_date, end_date):
+        """
+        single-flight loading, a request covered by an in-flight load is sliced from its result, and a request
+        overlapping in-flight loads waits for them so that the overlap is then served from the cache
+        """
+        overlapping = []
+        for load in self.inflight:
+            if load.covers(tickers, start_date, end_date):
+                self.coalesced += 1
+                self.logger.log_info(f'Coalesced into in-flight load ({self.coalesced} so far)')
+                data = await asyncio.shield(load.future)  # type: Panel
+                return data.select(tickers, start_date, end_date)
+            if load.overlaps(tickers, start_date, end_date):
+                overlapping.append(load.future)
+
+        if len(overlapping) > 0:
+            await asyncio.wait(overlapping)
+
+        future = self.loop.run_in_executor(self.executor, self.retrieve_data_from_db, tickers, start_date, end_date)
+        load = InFlightLoad(tickers, start_date, end_date, future)
+        self.inflight.append(load)
+        try:
+            return await asyncio.shield(future)
+        finally:
+            self.inflight.remove(load)
+
+    def update_tickers(self, tickers):
+        with self.write_lock:
+            new_dates = self.writer.update_data(tickers, self.update_workers)
+        self.cache.invalidate([ticker for ticker, new_date in new_dates.items() if new_date is not None])
+
     def retrieve_data_from_db(self, tickers, start_date, end_date):
-        with DataManager(self.db_dir) as dm:
-            data = dm.get_data(tickers, start_date, end_date)
+        self.update_tickers(tickers)
+
+        # load missed tickers over a range that also covers what is cached for them, then serve from cache
+        missed = self.cache.missing(tickers, start_date, end_date)
+        if len(missed) > 0:
+            load_start, load_end = self.cache.expand_range(missed, start_date, end_date)
+            self.cache.put(self._get_reader().read_panel(missed, load_start, load_end), load_start, load_end)
+        self.logger.log_info(self.cache)
+
+        data = self.cache.get(tickers, start_date, end_date)
+        if data is None:  # larger than the cache budget
+            data = self._get_reader().read_panel(tickers, start_date, end_date)
         return data
+
+    def read_chunk(self, tickers, start_date, end_date):
+        """
+        chunks bypass the cache, caching them would hold on to the whole history the stream is meant to avoid
+        """
+        return self._get_reader().read_panel(tickers, pd.Timestamp(start_date), pd.Timestamp(end_date))
+
+    def _get_reader(self) -> DataManager:
+        if not hasattr(self.readers, 'dm'):
+            self.readers.dm = DataManager(self.db_dir, self.column_dir).open_reader()
+        return self.readers.dm
@@ -0,0 +1,104 @@
+"""
+tick sources behind the data server broadcast
+"""
+
+from abc import ABC, abstractmethod
+import numpy as np
+
+
+class FeedSource(ABC):
+    rate = None  # requested ticks per second, None if the source doesn't have one
+
+    def __init__(self):
+        self.generated = 0
+
+    @abstractmethod
+    def generate(self, tickers, start, end, interval):
+        """
+        ticks of tickers between start and end (int64 ns), interval is the nominal round length in seconds
+        return (columns into tickers, timestamps, prices, sizes) in time order
+        """
+        raise NotImplementedError('generate is not implemented')
+
+
+class CounterFeed(FeedSource):
+    """
+    one tick per ticker and round priced at the round number, for checking the plumbing
+    """
+    def __init__(self):
+        super(CounterFeed, self).__init__()
+        self.counter = 0
+
+    def generate(self, tickers, start, end, interval):
+        self.counter += 1
+        self.generated += len(tickers)
+        return (np.arange(len(tickers)), np.full(len(tickers), end, dtype='int64'),
+                np.full(len(tickers), float(self.counter)), np.ones(len(tickers)))
+
+
+class SyntheticFeed(FeedSource):
+    """
+    poisson arrivals at the requested rate that switch in and out of bursts, tickers are picked uniformly,
+    prices follow a geometric brownian motion per ticker and sizes are round lots
+    """
+    seconds_per_year = 252 * 6.5 * 3600
+
+    def __init__(self, rate=1000, volatility=0.3, drift=0.0, price=100.0, burst=5.0, burst_probability=0.05,
+                 seed=None):
+        super(SyntheticFeed, self).__init__()
+        self.rate = rate
+        self.volatility = volatility
+        self.drift = drift
+        self.initial_price = price
+        self.burst = burst  # arrival rate multiplier while bursting
+        self.burst_probability = burst_probability  # chance of switching in or out of a burst every round
+        self.bursting = False
+        self.rng = np.random.default_rng(seed)
+        self.prices = {}
+
+    def generate(self, tickers, start, end, interval):
+        if self.rng.random() < self.burst_probability:
+            self.bursting = not self.bursting
+        # the count follows the nominal round length, so a loop that can't keep up shows as a lower achieved rate
+        expected = self.rate * interval * (self.burst if self.bursting else 1)
+        count = self.rng.poisson(expected) if len(tickers) > 0 else 0
+        self.generated += count
+
+        columns = self.rng.integers(0, max(len(tickers), 1), count)
+        timestamps = np.sort(self.rng.integers(start, max(end, start + 1), count))
+
+        # log returns within the round are split over each ticker's ticks, cumulated per ticker in time order
+        ticks = np.bincount(columns, minlength=len(tickers))
+        dt = (end - start) / 1e9 / self.seconds_per_year / np.maximum(ticks[columns], 1)
+        returns = (self.drift - self.volatility ** 2 / 2) * dt \
+            + self.volatility * np.sqrt(dt) * self.rng.standard_normal(count)
+        order = np.argsort(columns, kind='stable')
+        returns = returns[order]
+        cumulated = np.cumsum(returns)
+        traded = np.flatnonzero(ticks)
+        firsts = np.r_[0, np.cumsum(ticks)[:-1]][traded]
+        offsets = np.zeros(len(tickers))
+        offsets[traded] = cumulated[firsts] - returns[firsts]
+        cumulated -= np.repeat(offsets, ticks)
+
+        last = np.array([self.prices.get(ticker, self.initial_price) for ticker in tickers])
+        prices = np.empty(count)
+        prices[order] = last[columns[order]] * np.exp(cumulated)
+        for column, price in zip(traded, prices[order][firsts + ticks[traded] - 1]):
+            self.prices[tickers[column]] = price
+
+        sizes = self.rng.geometric(0.3, count) * 100.0
+        return columns, timestamps, prices, sizes
+
+
+def make_feed(config):
+    """
+    feed source from the "feed" config entry, {"type": "counter"} or {"type": "synthetic", ...parameters}
+    """
+    config = dict(config or {'type': 'counter'})
+    feed_type = config.pop('type', 'counter')
+    if feed_type == 'counter':
+        return CounterFeed()
+    if feed_type == 'synthetic':
+        return SyntheticFeed(**config)
+    raise ValueError(f'Unrecognized feed type {feed_type}')
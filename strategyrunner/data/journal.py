@@ -0,0 +1,60 @@
+"""
+append-only binary journal of broadcast messages for recording and replaying the real-time feed
+"""
+
+import struct
+import time
+
+
+record_header = struct.Struct('<qII')  # send time in ns, topic length, payload length
+
+
+class JournalWriter:
+    """
+    every record is the header followed by the topic and the payload, a record cut short by a crash is
+    ignored by the reader
+    """
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'ab')
+        self.records = 0
+
+    def __str__(self):
+        return f'Journal {self.path} / {self.records} records written'
+
+    def __repr__(self):
+        return self.__str__()
+
+    def write(self, topic, payload, timestamp=None):
+        timestamp = time.time_ns() if timestamp is None else timestamp
+        self.file.write(record_header.pack(timestamp, len(topic), len(payload)))
+        self.file.write(topic)
+        self.file.write(payload)
+        self.records += 1
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class JournalReader:
+    def __init__(self, path):
+        self.path = path
+
+    def __iter__(self):
+        """
+        yield (timestamp, topic, payload) in recorded order
+        """
+        with open(self.path, 'rb') as f:
+            while True:
+                header = f.read(record_header.size)
+                if len(header) < record_header.size:
+                    return
+                timestamp, topic_size, payload_size = record_header.unpack(header)
+                topic = f.read(topic_size)
+                payload = f.read(payload_size)
+                if len(payload) < payload_size:
+                    return
+                yield timestamp, topic, payload
@@ -0,0 +1,109 @@
+"""
+wide (date x ticker) price block
+"""
+
+import numpy as np
+import pandas as pd
+
+
+class Panel:
+    fields = ['open', 'high', 'low', 'close', 'volume']
+
+    def __init__(self, tickers, index, open_, high, low, close, volume=None):
+        """
+        index is an int64 ns array of dates, each field is a (date x ticker) array
+        """
+        self.tickers = list(tickers)
+        self.index = np.asarray(index, dtype='int64')
+        self.open = open_
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+        self.segment = None  # shared memory behind the arrays, if any, kept alive with the panel
+
+        if self.close.shape != (self.index.shape[0], len(self.tickers)):
+            raise ValueError(f'Panel shape {self.close.shape} doesn\'t match {len(self.index)} dates '
+                             f'and {len(self.tickers)} tickers')
+
+    def __len__(self):
+        return self.index.shape[0]
+
+    def __str__(self):
+        if len(self) == 0:
+            return f'Panel of {", ".join(self.tickers)} with no data'
+        return f'Panel of {", ".join(self.tickers)} from {self.timestamps[0].date()} to {self.timestamps[-1].date()}'
+
+    def __repr__(self):
+        return self.__str__()
+
+    @property
+    def timestamps(self):
+        return pd.DatetimeIndex(self.index.view('datetime64[ns]'))
+
+    @property
+    def nbytes(self):
+        return self.index.nbytes + sum(getattr(self, field).nbytes for field in self.fields
+                                       if getattr(self, field) is not None)
+
+    def select(self, tickers, start_date, end_date):
+        """
+        sub-panel of tickers between start and end date (inclusive)
+        """
+        lo = np.searchsorted(self.index, pd.Timestamp(start_date).normalize().value, side='left')
+        hi = np.searchsorted(self.index, pd.Timestamp(end_date).value, side='right')
+        if list(tickers) == self.tickers:
+            columns = slice(None)
+        else:
+            positions = {ticker: idx for idx, ticker in enumerate(self.tickers)}
+            columns = [positions[ticker] for ticker in tickers]
+
+        arrays = [getattr(self, field) for field in self.fields]
+        return Panel(tickers, self.index[lo:hi], *[x[lo:hi, columns] if x is not None else None for x in arrays])
+
+    def fill_missing(self, policy='nan'):
+        """
+        'nan' leaves missing bars as they are, 'ffill' carries the last close forward with zero volume
+        and 'drop' removes dates where any ticker is missing
+        """
+        if policy not in ('nan', 'ffill', 'drop'):
+            raise ValueError(f'Unrecognized missing data policy {policy}')
+
+        missing = np.isnan(self.close)
+        if policy == 'nan' or not missing.any():
+            return self
+
+        if policy == 'drop':
+            keep = ~missing.any(axis=1)
+            arrays = [getattr(self, field) for field in self.fields]
+            return Panel(self.tickers, self.index[keep], *[x[keep] if x is not None else None for x in arrays])
+
+        # row of the last available close for every cell
+        rows = np.where(missing, 0, np.arange(len(self))[:, None])
+        np.maximum.accumulate(rows, axis=0, out=rows)
+        last_close = self.close[rows, np.arange(len(self.tickers))]
+
+        arrays = []
+        for field in self.fields:
+            array = getattr(self, field)
+            if array is not None:
+                array = np.where(missing, 0 if field == 'volume' else last_close, array)
+            arrays.append(array)
+        return Panel(self.tickers, self.index, *arrays)
+
+    @classmethod
+    def from_frame(cls, data: pd.DataFrame):
+        """
+        build from the (field, ticker) column layout returned by DataManager.get_data
+        """
+        tickers = data.close.columns.tolist()
+        index = data.index.values.astype('datetime64[ns]').view('int64')
+        arrays = [data[field][tickers].values if field in data else None for field in cls.fields]
+        return cls(tickers, index, *arrays)
+
+    def to_frame(self) -> pd.DataFrame:
+        fields = [field for field in self.fields if getattr(self, field) is not None]
+        columns = pd.MultiIndex.from_product([fields, self.tickers])
+        values = np.concatenate([getattr(self, field) for field in fields], axis=1)
+        data = pd.DataFrame(values, index=self.timestamps.rename('date'), columns=columns)
+        return data.sort_index(axis=1)
@@ -0,0 +1,121 @@
+"""
+in-memory per-ticker cache of calendar-aligned bars
+"""
+
+from collections import OrderedDict
+import threading
+import numpy as np
+import pandas as pd
+
+from .panel import Panel
+
+
+class CacheEntry:
+    def __init__(self, panel: Panel, start_date, end_date):
+        self.panel = panel  # single ticker
+        self.start_date = start_date
+        self.end_date = end_date
+
+    def covers(self, start_date, end_date):
+        return self.start_date <= start_date and self.end_date >= end_date
+
+
+class PanelCache:
+    """
+    LRU over tickers bounded by the bytes held, any date sub-range of a cached ticker is served by slicing
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # type: OrderedDict[str, CacheEntry]
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()  # shared by the data server executor threads
+
+    def __str__(self):
+        return f'Cache {len(self.entries)} tickers / {self.nbytes / 2 ** 20:.1f} of {self.max_bytes / 2 ** 20:.1f}MB ' \
+               f'/ {self.hits} hits / {self.misses} misses / {self.evictions} evictions'
+
+    def __repr__(self):
+        return self.__str__()
+
+    def missing(self, tickers, start_date, end_date):
+        """
+        return tickers not covering the range, counting hits and misses
+        """
+        start_date, end_date = self._clip(start_date, end_date)
+        with self.lock:
+            missed = [ticker for ticker in tickers
+                      if ticker not in self.entries or not self.entries[ticker].covers(start_date, end_date)]
+            self.misses += len(missed)
+            self.hits += len(tickers) - len(missed)
+        return missed
+
+    def expand_range(self, tickers, start_date, end_date):
+        """
+        range to load so that the new entries also cover what is already cached for the tickers
+        """
+        start_date, end_date = self._clip(start_date, end_date)
+        with self.lock:
+            for ticker in tickers:
+                if ticker in self.entries:
+                    start_date = min(start_date, self.entries[ticker].start_date)
+                    end_date = max(end_date, self.entries[ticker].end_date)
+        return start_date, end_date
+
+    def put(self, panel: Panel, start_date, end_date):
+        start_date, end_date = self._clip(start_date, end_date)
+        with self.lock:
+            for idx, ticker in enumerate(panel.tickers):
+                # copy columns out so that evicting a ticker frees its memory
+                arrays = [np.ascontiguousarray(getattr(panel, field)[:, idx:idx + 1]) for field in Panel.fields]
+                entry = CacheEntry(Panel([ticker], panel.index, *arrays), start_date, end_date)
+                if entry.panel.nbytes > self.max_bytes:
+                    continue
+
+                self._remove(ticker)
+                self.entries[ticker] = entry
+                self.nbytes += entry.panel.nbytes
+
+            while self.nbytes > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def get(self, tickers, start_date, end_date):
+        """
+        assemble a panel from cached tickers, None if any of them is not covered
+        """
+        start_date, end_date = self._clip(start_date, end_date)
+        with self.lock:
+            entries = [self.entries.get(ticker) for ticker in tickers]
+            if any(entry is None or not entry.covers(start_date, end_date) for entry in entries):
+                return None
+            for ticker in tickers:
+                self.entries.move_to_end(ticker)
+
+        # entries are aligned to the same calendar so the sliced dates are identical
+        slices = [entry.panel.select([ticker], start_date, end_date) for ticker, entry in zip(tickers, entries)]
+        if len(slices) == 1:
+            return slices[0]
+        arrays = [np.concatenate([getattr(panel, field) for panel in slices], axis=1) for field in Panel.fields]
+        return Panel(tickers, slices[0].index, *arrays)
+
+    def invalidate(self, tickers):
+        with self.lock:
+            for ticker in tickers:
+                self._remove(ticker)
+
+    def stats(self):
+        return {'tickers': len(self.entries), 'bytes': self.nbytes, 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions}
+
+    def _remove(self, ticker):
+        entry = self.entries.pop(ticker, None)
+        if entry is not None:
+            self.nbytes -= entry.panel.nbytes
+
+    @staticmethod
+    def _clip(start_date, end_date):
+        # data never goes beyond today, see DataManager.read_panel
+        return pd.Timestamp(start_date), min(pd.Timestamp(end_date), pd.Timestamp.today().normalize())
@@ -0,0 +1,44 @@
+"""
+fixed size look-back window of (bar x ticker) rows
+"""
+
+import numpy as np
+
+
+class RingBuffer:
+    """
+    every row is written twice, at slot and slot + capacity, so that the latest rows are always one contiguous
+    slice of the storage and can be handed out as a view without unwrapping
+    """
+    def __init__(self, capacity, width, dtype='float64'):
+        self.capacity = max(int(capacity), 1)
+        self.storage = np.full((2 * self.capacity, width), np.nan, dtype=dtype)
+        self.head = 0  # slot of the next row
+        self.count = 0
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def __str__(self):
+        return f'Ring buffer of {len(self)} / {self.capacity} rows'
+
+    def __repr__(self):
+        return self.__str__()
+
+    def append(self, row):
+        self.storage[self.head] = row
+        self.storage[self.head + self.capacity] = row
+        self.head = (self.head + 1) % self.capacity
+        self.count += 1
+
+    def view(self):
+        """
+        read-only view of the rows in time order, it is overwritten in place by later appends
+        """
+        end = self.head + self.capacity
+        window = self.storage[end - len(self):end]
+        window.flags.writeable = False
+        return window
+
+    def last(self):
+        return self.storage[self.head + self.capacity - 1]
@@ -0,0 +1,139 @@
+"""
+same-host sharing of panels through named shared memory segments
+"""
+
+from multiprocessing import shared_memory, resource_tracker
+import os
+import numpy as np
+
+from .panel import Panel
+from ..utils import get_name_hash
+
+
+class Segment:
+    def __init__(self, key, shm: shared_memory.SharedMemory, layout):
+        self.key = key
+        self.shm = shm
+        self.layout = layout  # [[array name, dtype, offset, shape], ...]
+        self.refs = 0
+
+
+class SharedPanelRegistry:
+    """
+    data server side, identical requests share one read-only segment that is unlinked when its last
+    reference is released. segment names carry the pid of the server so that the ones left by a server that
+    died are unlinked by the next one
+    """
+    alignment = 64
+    shm_dir = '/dev/shm'
+
+    def __init__(self):
+        self.segments = {}  # type: dict[str, Segment]
+        self.keys = {}  # request key -> segment name
+        self.prefix = f'sr_{os.getpid()}_'
+        leftovers = self.unlink_leftovers()
+        if leftovers > 0:
+            print(f'Unlinked {leftovers} shared segments left by stopped data servers')
+
+    def __len__(self):
+        return len(self.segments)
+
+    @property
+    def nbytes(self):
+        return sum(segment.shm.size for segment in self.segments.values())
+
+    def publish(self, key, panel: Panel):
+        """
+        return (segment name, layout) holding the panel, adding a reference
+        """
+        if key not in self.keys:
+            arrays = [('index', panel.index)] + [(field, getattr(panel, field)) for field in Panel.fields
+                                                 if getattr(panel, field) is not None]
+            offsets, size = [], 0
+            for _, array in arrays:
+                offsets.append(size)
+                size += -(-array.nbytes // self.alignment) * self.alignment
+
+            shm = shared_memory.SharedMemory(name=self.prefix + get_name_hash(10), create=True, size=max(size, 1))
+            layout = []
+            for (name, array), offset in zip(arrays, offsets):
+                np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf, offset=offset)[:] = array
+                layout.append([name, array.dtype.str, offset, list(array.shape)])
+
+            self.segments[shm.name] = Segment(key, shm, layout)
+            self.keys[key] = shm.name
+
+        segment = self.segments[self.keys[key]]
+        segment.refs += 1
+        return segment.shm.name, segment.layout
+
+    def release(self, name):
+        segment = self.segments.get(name)
+        if segment is None:
+            raise ValueError(f'Shared segment {name} does not exist')
+
+        segment.refs -= 1
+        if segment.refs <= 0:
+            # processes that still map the segment keep their pages until they unmap
+            del self.segments[name]
+            del self.keys[segment.key]
+            segment.shm.close()
+            segment.shm.unlink()
+
+    def close(self):
+        for name in list(self.segments):
+            self.segments[name].refs = 0
+            self.release(name)
+
+    @classmethod
+    def unlink_leftovers(cls):
+        """
+        unlink the segments of data servers that are no longer running, only where segments show up as files
+        """
+        if not os.path.isdir(cls.shm_dir):
+            return 0
+
+        count = 0
+        for name in os.listdir(cls.shm_dir):
+            parts = name.split('_')
+            if len(parts) != 3 or parts[0] != 'sr' or not parts[1].isdigit() or _is_running(int(parts[1])):
+                continue
+            try:
+                os.unlink(os.path.join(cls.shm_dir, name))
+                count += 1
+            except OSError:
+                pass  # unlinked by someone else in the meantime
+        return count
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def attach_panel(tickers, name, layout) -> Panel:
+    """
+    map a published segment read-only, the panel holds the mapping
+    """
+    try:
+        shm = shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # before python 3.13 attaching registers with the resource tracker, which would unlink the segment
+        # when this process exits even though the data server owns it
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+
+    arrays = {}
+    for array_name, dtype, offset, shape in layout:
+        array = np.ndarray(tuple(shape), dtype=dtype, buffer=shm.buf, offset=offset)
+        array.flags.writeable = False
+        arrays[array_name] = array
+
+    panel = Panel(tickers, arrays['index'], *[arrays.get(field) for field in Panel.fields])
+    panel.segment = shm
+    return panel
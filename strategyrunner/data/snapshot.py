@@ -0,0 +1,76 @@
+"""
+binary market data snapshot frames, a fixed header followed by packed records of many tickers
+
+the tickers of a subscriber are published together on a topic named after the ticker list, and records give
+their ticker by its position in that list so that ticker names of any length cost four bytes
+"""
+
+import hashlib
+import struct
+import numpy as np
+
+
+record_dtype = np.dtype([('column', '<u4'), ('timestamp', '<i8'), ('price', '<f8'), ('size', '<f8')])
+header = struct.Struct('<QI')  # sequence number of the topic, number of records
+
+
+def feed_topic(tickers):
+    """
+    zmq subscriptions match prefixes, the delimiter keeps a topic from matching a longer one
+    """
+    return hashlib.blake2b(','.join(tickers).encode(), digest_size=8).hexdigest().encode() + b'\0'
+
+
+def topic_name(topic):
+    return bytes(topic).rstrip(b'\0').decode()
+
+
+def encode_snapshot(seq, columns, timestamps, prices, sizes):
+    """
+    columns are positions in the ticker list of the topic, timestamps are int64 ns
+    """
+    records = np.empty(len(timestamps), dtype=record_dtype)
+    records['column'] = columns
+    records['timestamp'] = timestamps
+    records['price'] = prices
+    records['size'] = sizes
+    return header.pack(seq, records.shape[0]) + records.tobytes()
+
+
+def decode_snapshot(buffer):
+    """
+    return the sequence number and a read-only record array viewing the buffer
+    """
+    seq, count = header.unpack_from(buffer)
+    records = np.frombuffer(buffer, dtype=record_dtype, count=count, offset=header.size)
+    return seq, records
+
+
+class SequenceTracker:
+    """
+    per-topic sequence numbers on the receiving side, counting gaps and messages missed in them
+    """
+    def __init__(self):
+        self.last = {}
+        self.received = 0
+        self.gaps = 0
+        self.missed = 0
+
+    def __str__(self):
+        return f'{self.received} received / {self.gaps} gaps / {self.missed} missed'
+
+    def __repr__(self):
+        return self.__str__()
+
+    def check(self, topic, seq):
+        """
+        return the number of messages missed before this one
+        """
+        self.received += 1
+        last = self.last.get(topic)
+        self.last[topic] = seq
+        if last is None or seq <= last + 1:
+            return 0
+        self.gaps += 1
+        self.missed += seq - last - 1
+        return seq - last - 1
@@ -0,0 +1,103 @@
+"""
+market calendar as an int64 ns array with vectorized trading day arithmetic
+"""
+
+import os
+import numpy as np
+import pandas as pd
+
+
+def to_ns(dates):
+    """
+    convert a date or an array of dates to int64 ns
+    """
+    if np.isscalar(dates) or isinstance(dates, (pd.Timestamp, np.datetime64)):
+        return pd.Timestamp(dates).value
+    return pd.to_datetime(dates).values.astype('datetime64[ns]').view('int64')
+
+
+def from_ns(values):
+    if np.isscalar(values):
+        return pd.Timestamp(values)
+    return pd.DatetimeIndex(np.asarray(values, dtype='int64').view('datetime64[ns]'))
+
+
+class TradingCalendar:
+    def __init__(self, dates):
+        self.dates = np.asarray(dates, dtype='int64')
+
+    def __len__(self):
+        return self.dates.shape[0]
+
+    def __str__(self):
+        if len(self) == 0:
+            return 'Empty trading calendar'
+        return f'Trading calendar from {from_ns(self.dates[0]).date()} to {from_ns(self.dates[-1]).date()}'
+
+    def __repr__(self):
+        return self.__str__()
+
+    @classmethod
+    def load(cls, conn, cache_file=None):
+        """
+        load from the disk cache if there is one, otherwise from the MarketCalendarUS table
+        """
+        if cache_file is not None and os.path.isfile(cache_file):
+            return cls(np.load(cache_file))
+
+        dates = [x[0] for x in conn.execute('select date from MarketCalendarUS order by date').fetchall()]
+        calendar = cls(pd.to_datetime(dates, utc=True).tz_localize(None).values.astype('datetime64[ns]').view('int64'))
+        calendar.save(cache_file)
+        return calendar
+
+    def save(self, cache_file):
+        if cache_file is None:
+            return
+        tmp = f'{cache_file}.tmp'
+        with open(tmp, 'wb') as f:
+            np.save(f, self.dates)
+        os.replace(tmp, cache_file)
+
+    @property
+    def last_date(self):
+        return from_ns(self.dates[-1]) if len(self) > 0 else None
+
+    def between(self, start_date, end_date):
+        """
+        trading days between start and end date (inclusive) as int64 ns
+        """
+        lo = np.searchsorted(self.dates, to_ns(pd.Timestamp(start_date).normalize()), side='left')
+        hi = np.searchsorted(self.dates, to_ns(end_date), side='right')
+        return self.dates[lo:hi]
+
+    def count(self, start_dates, end_dates):
+        """
+        number of trading days between start and end dates (inclusive)
+        """
+        return np.searchsorted(self.dates, to_ns(end_dates), side='right') \
+            - np.searchsorted(self.dates, to_ns(start_dates), side='left')
+
+    def is_trading_day(self, dates):
+        values = to_ns(dates)
+        pos = np.minimum(np.searchsorted(self.dates, values), len(self) - 1)
+        return self.dates[pos] == values
+
+    def next(self, dates, n=1, as_ns=False):
+        """
+        n-th trading day strictly after each date
+        """
+        pos = np.searchsorted(self.dates, to_ns(dates), side='right') + n - 1
+        return self._lookup(pos, as_ns)
+
+    def previous(self, dates, n=1, as_ns=False):
+        """
+        n-th trading day strictly before each date
+        """
+        pos = np.searchsorted(self.dates, to_ns(dates), side='left') - n
+        return self._lookup(pos, as_ns)
+
+    def _lookup(self, pos, as_ns):
+        if np.any(pos < 0) or np.any(pos >= len(self)):
+            raise ValueError(f'Date is out of the range of {self}')
+        values = self.dates[pos]
+        return values if as_ns else from_ns(values)
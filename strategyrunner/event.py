@@ -1,7 +1,8 @@
 
 from enum import Enum
+import numpy as np
 from . import const
-from .helpers import Signal
+from .helpers import Signal, SparseVector, TickerIndex
 
 
 class Direction(Enum):
@@ -10,6 +11,8 @@ class Direction(Enum):
 
 
 class Event:
+    __slots__ = ('type',)
+
     def __init__(self, event_type):
         self.type = event_type  # type: const.Event
 
@@ -18,6 +21,8 @@ class Event:
 
 
 class BaseEvent(Event):
+    __slots__ = ('timestamp', 'sid')
+
     def __init__(self, event_type, timestamp, sid):
         super(BaseEvent, self).__init__(event_type)
         self.timestamp = timestamp
@@ -28,10 +33,13 @@ class BaseEvent(Event):
 
 
 class AccountOpenEvent(BaseEvent):
-    def __init__(self, timestamp, sid, capital, broker, tickers, start_time=None, end_time=None, pid=None):
+    __slots__ = ('capital', 'data_request', 'pid')
+
+    def __init__(self, timestamp, sid, capital, broker, tickers, start_time=None, end_time=None, pid=None,
+                 chunk_size=None):
         super(AccountOpenEvent, self).__init__(const.Event.ACCT_OPEN, timestamp, sid)
         self.capital = capital
-        self.data_request = DataRequestEvent(broker, tickers, start_time, end_time)
+        self.data_request = DataRequestEvent(broker, tickers, start_time, end_time, chunk_size)
         self.pid = pid
 
     def __str__(self):
@@ -40,6 +48,8 @@ class AccountOpenEvent(BaseEvent):
 
 
 class AccountCloseEvent(BaseEvent):
+    __slots__ = ('pid',)
+
     def __init__(self, timestamp, sid, pid=None):
         super(AccountCloseEvent, self).__init__(const.Event.ACCT_CLOSE, timestamp, sid)
         self.pid = pid
@@ -50,7 +60,12 @@ class AccountCloseEvent(BaseEvent):
 
 
 class DataRequestEvent(Event):
-    def __init__(self, broker, tickers, start_time=None, end_time=None):
+    __slots__ = ('broker', 'tickers', 'start_time', 'end_time', 'chunk_size')
+
+    def __init__(self, broker, tickers, start_time=None, end_time=None, chunk_size=None):
+        """
+        chunk_size is the number of bars per chunk to stream historical data in, None to send it at once
+        """
         super(DataRequestEvent, self).__init__(const.Event.DATA)
         if broker == const.Broker.SIMULATED and (start_time is None or end_time is None):
             raise ValueError('Time needed for simulated data request')
@@ -59,60 +74,200 @@ class DataRequestEvent(Event):
         self.tickers = tickers
         self.start_time = start_time
         self.end_time = end_time
+        self.chunk_size = chunk_size
 
     def __str__(self):
         prefix = f'Data request from {self.broker} for {self.tickers}'
         if self.broker == const.Broker.SIMULATED:
-            return prefix + f' from {self.start_time} to {self.end_time}'
+            suffix = f' in chunks of {self.chunk_size} bars' if self.chunk_size else ''
+            return prefix + f' from {self.start_time} to {self.end_time}' + suffix
         return prefix
 
 
+class DataChunkEvent(Event):
+    __slots__ = ('stream',)
+
+    def __init__(self, stream):
+        super(DataChunkEvent, self).__init__(const.Event.DATA_CHUNK)
+        self.stream = stream
+
+    def __str__(self):
+        return f'Next chunk of data stream {self.stream}'
+
+
+class DataReleaseEvent(Event):
+    __slots__ = ('segment', 'stream')
+
+    def __init__(self, segment=None, stream=None):
+        """
+        release a shared segment and/or a data stream that won't be read to the end
+        """
+        super(DataReleaseEvent, self).__init__(const.Event.DATA_RELEASE)
+        self.segment = segment
+        self.stream = stream
+
+    def __str__(self):
+        released = [f'shared data {self.segment}'] if self.segment is not None else []
+        released += [f'data stream {self.stream}'] if self.stream is not None else []
+        return f'Release {" and ".join(released)}'
+
+
+class FeedStatusEvent(Event):
+    __slots__ = ('sid', 'received', 'gaps', 'missed', 'conflated', 'lag', 'rate')
+
+    def __init__(self, sid, received, gaps, missed, conflated, lag, rate=0.0):
+        """
+        market data feed health reported by a subscriber, lag is in seconds and rate in ticks per second
+        """
+        super(FeedStatusEvent, self).__init__(const.Event.FEED_STATUS)
+        self.sid = sid
+        self.received = received
+        self.gaps = gaps
+        self.missed = missed
+        self.conflated = conflated
+        self.lag = lag
+        self.rate = rate
+
+    def __str__(self):
+        return f'Feed of {self.sid}: {self.received} received / {self.gaps} gaps / {self.missed} missed / ' \
+               f'{self.conflated} conflated / {self.lag:.3f}s lag / {self.rate:.0f} ticks/s'
+
+
 class SignalEvent(BaseEvent):
+    __slots__ = ('signal',)
+
     def __init__(self, timestamp, sid, signal: Signal):
         super(SignalEvent, self).__init__(const.Event.SIGNAL, timestamp, sid)
         self.signal = signal
 
     def __str__(self):
         text = super(SignalEvent, self).__str__() + '\n'
-        text += '\n'.join([f'   {ticker} $ {sig}' for ticker, sig in self.signal.signal.items()]) + '\n'
+        text += '\n'.join([f'   {ticker} $ {sig}' for ticker, sig in self.signal.items()]) + '\n'
         return text
 
 
+class SignalBatchEvent(BaseEvent):
+    __slots__ = ('signals', 'seq')
+
+    def __init__(self, timestamp, sid, signals, seq):
+        """
+        consecutive signals sent together, seq is the number of signals sent so far including these
+        """
+        super(SignalBatchEvent, self).__init__(const.Event.SIGNAL_BATCH, timestamp, sid)
+        self.signals = signals  # type: list[SignalEvent]
+        self.seq = seq
+
+    def __str__(self):
+        return super(SignalBatchEvent, self).__str__() + f' {len(self.signals)} signals up to {self.seq}'
+
+
+class SignalAckEvent(Event):
+    __slots__ = ('sid', 'seq')
+
+    def __init__(self, sid, seq):
+        super(SignalAckEvent, self).__init__(const.Event.SIGNAL_ACK)
+        self.sid = sid
+        self.seq = seq
+
+    def __str__(self):
+        return f'{self.sid} signals processed up to {self.seq}'
+
+
 class OrderEvent(BaseEvent):
-    def __init__(self, timestamp, sid):
+    __slots__ = ('index', 'positions', 'order_types', 'quantities')
+
+    def __init__(self, timestamp, sid, index: TickerIndex):
+        """
+        orders are kept sparse, keyed by position in the ticker index of the account
+        """
         super(OrderEvent, self).__init__(const.Event.ORDER, timestamp, sid)
-        self.orders = {}
+        self.index = index
+        self.positions = np.zeros(0, dtype='intp')
+        self.order_types = np.zeros(0, dtype='uint8')
+        self.quantities = np.zeros(0, dtype='int64')
 
     def add(self, ticker, order_type, quantity):
         if quantity == 0:
             raise ValueError('Quantity shouldn''t be 0')
-        self.orders[ticker] = [order_type, quantity]
+        self.set(np.r_[self.positions, self.index[ticker]], np.r_[self.order_types, order_type.value],
+                 np.r_[self.quantities, quantity])
+
+    def set(self, positions, order_types, quantities):
+        """
+        replace all orders, order_types is an array of const.Order values or a single const.Order
+        """
+        if isinstance(order_types, const.Order):
+            order_types = np.full(len(positions), order_types.value)
+        if (np.asarray(quantities) == 0).any():
+            raise ValueError('Quantity shouldn''t be 0')
+        self.positions = np.asarray(positions, dtype='intp')
+        self.order_types = np.asarray(order_types, dtype='uint8')
+        self.quantities = np.asarray(quantities, dtype='int64')
 
     def added(self):
-        return len(self.orders) > 0
+        return len(self.positions) > 0
+
+    def items(self):
+        """
+        (ticker, (order type, quantity)) in order
+        """
+        return zip(self.index.decode(self.positions.tolist()),
+                   zip(map(const.Order, self.order_types.tolist()), self.quantities.tolist()))
+
+    def dense(self):
+        return SparseVector(self.index, self.positions, self.quantities).dense()
 
     def __str__(self):
         text = super(OrderEvent, self).__str__() + '\n'
-        text += '\n'.join([f'   {ticker} -> {qty: d}' for ticker, (_, qty) in self.orders.items()]) + '\n'
+        text += '\n'.join([f'   {ticker} -> {qty: d}' for ticker, (_, qty) in self.items()]) + '\n'
         return text
 
 
 class FillEvent(BaseEvent):
-    def __init__(self, timestamp, sid):
+    __slots__ = ('index', 'positions', 'quantities', 'prices', 'commissions')
+
+    def __init__(self, timestamp, sid, index: TickerIndex):
+        """
+        fills are kept sparse like orders
+        """
         super(FillEvent, self).__init__(const.Event.FILL, timestamp, sid)
-        self.fills = {}
+        self.index = index
+        self.positions = np.zeros(0, dtype='intp')
+        self.quantities = np.zeros(0, dtype='int64')
+        self.prices = np.zeros(0)
+        self.commissions = np.zeros(0)
 
     def add(self, ticker, price, quantity, commission=0):
-        self.fills[ticker] = [quantity, price, commission]
+        self.set(np.r_[self.positions, self.index[ticker]], np.r_[self.prices, price],
+                 np.r_[self.quantities, quantity], np.r_[self.commissions, commission])
+
+    def set(self, positions, prices, quantities, commissions=None):
+        self.positions = np.asarray(positions, dtype='intp')
+        self.prices = np.asarray(prices, dtype='float64')
+        self.quantities = np.asarray(quantities, dtype='int64')
+        self.commissions = np.zeros(len(self.positions)) if commissions is None \
+            else np.asarray(commissions, dtype='float64')
+
+    def items(self):
+        """
+        (ticker, (quantity, price, commission)) in order
+        """
+        return zip(self.index.decode(self.positions.tolist()),
+                   zip(self.quantities.tolist(), self.prices.tolist(), self.commissions.tolist()))
 
     def __str__(self):
         text = super(FillEvent, self).__str__() + '\n'
-        text += '\n'.join([f'   {ticker} {qty: d} @ {price}' for ticker, (qty, price, com) in self.fills.items()]) + '\n'
+        text += '\n'.join([f'   {ticker} {qty: d} @ {price}' for ticker, (qty, price, com) in self.items()]) + '\n'
         return text
 
 
 class QuoteEvent(BaseEvent):
-    def __init__(self, timestamp, sid, quotes: dict):
+    __slots__ = ('quotes',)
+
+    def __init__(self, timestamp, sid, quotes: SparseVector):
+        """
+        quotes holds the prices that changed since the previous quote event of the account
+        """
         super(QuoteEvent, self).__init__(const.Event.QUOTE, timestamp, sid)
         self.quotes = quotes
 
@@ -120,3 +275,18 @@ class QuoteEvent(BaseEvent):
         text = super(QuoteEvent, self).__str__() + '\n'
         text += '\n'.join([f'   {ticker} @ {price}' for ticker, price in self.quotes.items()]) + '\n'
         return text
+
+
+class QuoteBlockEvent(BaseEvent):
+    __slots__ = ('timestamps', 'prices')
+
+    def __init__(self, sid, timestamps, prices):
+        """
+        closes of consecutive bars without a signal, prices has a dense row in ticker index order per timestamp
+        """
+        super(QuoteBlockEvent, self).__init__(const.Event.QUOTE_BLOCK, timestamps[-1], sid)
+        self.timestamps = timestamps
+        self.prices = prices
+
+    def __str__(self):
+        return super(QuoteBlockEvent, self).__str__() + f' {len(self.timestamps)} bars from {self.timestamps[0]}'
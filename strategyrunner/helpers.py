@@ -1,34 +1,112 @@
 
 import asyncio
+import numpy as np
 
 
-class Signal:
+class TickerIndex:
+    """
+    fixed ticker <-> position mapping for everything that keeps per-ticker arrays, both ends of a connection
+    build the same one from the same ticker list
+    """
     def __init__(self, tickers):
-        self.tickers = tickers
-        self.template = {ticker: 0 for ticker in self.tickers}
-        self.signal = None  # type: dict
-        self.reset()
+        self.tickers = list(tickers)
+        self.positions = {ticker: idx for idx, ticker in enumerate(self.tickers)}
+
+    def __len__(self):
+        return len(self.tickers)
+
+    def __getitem__(self, ticker):
+        return self.positions[ticker]
+
+    def __str__(self):
+        return f'Ticker index of {", ".join(self.tickers)}'
+
+    def __repr__(self):
+        return self.__str__()
+
+    def encode(self, tickers):
+        return np.fromiter((self.positions[ticker] for ticker in tickers), dtype='int32', count=len(tickers))
+
+    def decode(self, positions):
+        return [self.tickers[idx] for idx in positions]
+
+
+class SparseVector:
+    """
+    entries of a vector over a ticker index at the given positions, everything else is implied
+    """
+    __slots__ = ('index', 'positions', 'values')
+
+    def __init__(self, index: TickerIndex, positions, values):
+        self.index = index
+        self.positions = np.asarray(positions, dtype='intp')
+        self.values = np.asarray(values)
+
+    @classmethod
+    def from_dense(cls, index: TickerIndex, dense, positions=None):
+        """
+        the nonzero entries of dense, or the entries at positions
+        """
+        positions = np.flatnonzero(dense != 0) if positions is None else positions
+        return cls(index, positions, dense[positions])
+
+    def __len__(self):
+        return len(self.positions)
+
+    def items(self):
+        return zip(self.index.decode(self.positions.tolist()), self.values.tolist())
+
+    def dense(self, fill=0.0):
+        vector = np.full(len(self.index), fill, dtype=self.values.dtype if self.values.size > 0 else 'float64')
+        vector[self.positions] = self.values
+        return vector
+
+    def __str__(self):
+        return str(dict(self.items()))
+
+    def __repr__(self):
+        return self.__str__()
+
+
+class Signal:
+    """
+    alphas are a vector in the order of a ticker index, shared with the data object and the trade record so that
+    signals can be turned into orders without looking tickers up
+    """
+    def __init__(self, tickers, alphas=None):
+        self.index = tickers if isinstance(tickers, TickerIndex) else TickerIndex(tickers)
+        self.tickers = self.index.tickers
+        self.alphas = np.zeros(len(self.index)) if alphas is None else alphas
+
+    def __getitem__(self, key):
+        return self.alphas[self.index[key]]
 
     def __setitem__(self, key, value):
-        if key not in self.signal:
+        if key not in self.index.positions:
             raise ValueError(f'Ticker {key} is not available for the current trader')
-        self.signal[key] = value
+        self.alphas[self.index.positions[key]] = value
 
     def values(self):
-        if self.signal is None:
-            raise RuntimeError('Signal is not set yet')
-        return self.signal.values()
+        return self.alphas
 
     def items(self):
-        if self.signal is None:
-            raise RuntimeError('Signal is not set yet')
-        return self.signal.items()
+        return zip(self.tickers, self.alphas.tolist())
+
+    def sparse(self) -> SparseVector:
+        return SparseVector.from_dense(self.index, self.alphas)
 
     def reset(self):
-        self.signal = self.template.copy()
+        self.alphas[:] = 0
+
+    def copy(self):
+        signal = Signal.__new__(Signal)
+        signal.index = self.index
+        signal.tickers = self.tickers
+        signal.alphas = self.alphas.copy()
+        return signal
 
     def __str__(self):
-        return str(self.signal)
+        return str(dict(self.items()))
 
     def __repr__(self):
         return self.__str__()
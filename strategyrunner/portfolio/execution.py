@@ -0,0 +1,46 @@
+"""
+order sizing and simulated execution shared by the portfolio manager and the local engine
+"""
+
+import numpy as np
+
+from .trade_record import TradeRecord
+from ..event import OrderEvent, FillEvent
+from ..helpers import Signal
+from .. import const
+
+
+def generate_order(timestamp, sid, signal: Signal, position: TradeRecord, prices) -> OrderEvent:
+    """
+    size positions so that the equity is split by the absolute alphas of the signal, sells go first because
+    they release capital. an all-zero signal closes every position. prices are in the ticker index order of
+    the position, which the signal has to share. only tickers with an alpha or a position are looked at
+    """
+    if signal.index is not position.index and signal.tickers != position.tickers:
+        raise ValueError('Signal and position tickers are not in the same order')
+
+    alphas = signal.sparse()
+    gross = np.abs(alphas.values).sum()
+    unit_capital = position.get_equity() / gross if gross > 0 else 0
+
+    active = np.union1d(alphas.positions, np.flatnonzero(position.positions != 0))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        target = signal.values()[active] * unit_capital / prices[active]
+    if not np.isfinite(target).all():
+        missing = position.index.decode(active[~np.isfinite(target)].tolist())
+        raise ValueError(f'No price to size {", ".join(missing)}')
+    delta = target.astype('int64') - position.positions[active]  # truncated towards zero like int()
+
+    order = OrderEvent(timestamp, sid, position.index)
+    traded = np.concatenate([np.flatnonzero(delta < 0), np.flatnonzero(delta > 0)])
+    order.set(active[traded], const.Order.LMT, delta[traded])
+    return order
+
+
+def simulate_fill(order: OrderEvent, prices) -> FillEvent:
+    """
+    fill everything at the given prices, which are in the order of the order's ticker index
+    """
+    fill = FillEvent(order.timestamp, order.sid, order.index)
+    fill.set(order.positions, prices[order.positions], order.quantities)
+    return fill
@@ -0,0 +1,44 @@
+"""
+in-process simulated execution, same bookkeeping as the portfolio manager without the messaging
+"""
+
+from .trade_record import TradeRecord
+from .execution import generate_order, simulate_fill
+from ..data import HistoricalDataObject
+from ..event import SignalEvent
+from ..logger import Logger
+
+
+class LocalEngine:
+    """
+    mirrors the manager: on every signal the bars since the previous signal are marked to market in one go,
+    then the order is sized on the last close and filled at it
+    """
+    def __init__(self, logger: Logger, timestamp, data_obj: HistoricalDataObject, capital):
+        self.logger = logger
+        self.data_obj = data_obj
+        self.position = TradeRecord(timestamp, capital, data_obj.index)
+        self.prev_row = 0
+
+    def on_signal(self, event: SignalEvent):
+        self._mark_to_market()
+
+        prices = self.data_obj.current_close
+        order = generate_order(event.timestamp, event.sid, event.signal, self.position, prices)
+        if order.added():
+            try:
+                self.position.update_from_fill(simulate_fill(order, prices))
+            except ValueError as e:
+                # the manager drops the rest of a fill that can't be paid for in the same way
+                self.logger.log_error(f'{e} at {event.timestamp}')
+
+    def close(self):
+        """
+        mark the bars after the last signal, like the manager does when the account is closed
+        """
+        self._mark_to_market()
+        return self.position
+
+    def _mark_to_market(self):
+        self.position.take_snapshots(*self.data_obj.quote_block(self.prev_row, self.data_obj.index_row))
+        self.prev_row = self.data_obj.index_row
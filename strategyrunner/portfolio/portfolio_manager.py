@@ -6,19 +6,27 @@ from typing import Dict, Union
 import pickle
 
 from ..async_agent import AsyncAgent
-from ..data import DataObject
+from ..data import DataObject, Dispatcher
 from ..portfolio import TradeRecord
-from ..event import OrderEvent, FillEvent, QuoteEvent, AccountOpenEvent, AccountCloseEvent, SignalEvent, BaseEvent
+from .execution import generate_order, simulate_fill
+from ..event import OrderEvent, FillEvent, QuoteEvent, AccountOpenEvent, AccountCloseEvent, SignalEvent, BaseEvent, \
+    DataReleaseEvent, DataChunkEvent, SignalBatchEvent, SignalAckEvent
 from ..logger import Logger
+from ..codec import EventCodec
+from .. import codec
 from .. import utils
 from .. import const
 
 
 class Account:
-    def __init__(self, timestamp, data_obj: DataObject, capital=10000):
-        self.position = TradeRecord(timestamp, capital, data_obj.tickers)
+    def __init__(self, timestamp, data_obj: DataObject, capital=10000, segment=None, pid=None, stream=None):
+        self.position = TradeRecord(timestamp, capital, data_obj.index)
         self.broker = data_obj.broker
         self.data_obj = data_obj
+        self.segment = segment  # shared memory data to release on close
+        self.stream = stream  # data stream still being read, released on close if it isn't finished
+        self.pid = pid  # trader socket identity, for acknowledgements
+        self.codec = EventCodec(data_obj.index)  # the trader builds the same from the same frames
         self.count = 0  # for checking if fills are completed
 
 
@@ -44,6 +52,7 @@ class PortfolioManager(AsyncAgent):
 
         self.data_socket = zmqa.Context().socket(zmq.REQ)
         self.data_socket.connect(f'tcp://127.0.0.1:{self.data_port}')
+        self.data_lock = asyncio.Lock()  # REQ socket is shared by all accounts and must stay lock-step
 
         self.run_coroutine(f'Starting listening on port {self.port}', self.handle_request)
         self.run_coroutine('', self.handle_events)
@@ -51,6 +60,10 @@ class PortfolioManager(AsyncAgent):
 
     async def handle_request(self):
         [pid, event] = await self.socket.recv_multipart()
+        if codec.is_encoded(event):  # signals, decoded by the account that knows the tickers
+            await self.account_queues[codec.read_sid(event)].put(event)
+            return True
+
         event = pickle.loads(event)  # type: Union[AccountOpenEvent, AccountCloseEvent]
 
         if event.type == const.Event.ACCT_OPEN:  # create new account
@@ -71,48 +84,59 @@ class PortfolioManager(AsyncAgent):
         return True
 
     async def handle_strategy_event(self, queue: asyncio.Queue, feedback: asyncio.Queue):
-        event = await queue.get()  # type: Union[AccountOpenEvent, SignalEvent]
-        if event.type != const.Event.SIGNAL:
+        event = await queue.get()  # type: Union[AccountOpenEvent, SignalEvent, SignalBatchEvent]
+        if isinstance(event, bytes):
+            event = self.accounts[codec.read_sid(event)].codec.decode(event)
+        if event.type not in (const.Event.SIGNAL, const.Event.SIGNAL_BATCH):
             self.logger.log_info(event)
 
         if event.type == const.Event.ACCT_OPEN:
-            await self.data_socket.send_pyobj(event.data_request)
-            dispatcher = await self.data_socket.recv_pyobj()
-            data_obj = dispatcher.dispatch()  # type: DataObject
+            async with self.data_lock:
+                await self.data_socket.send_pyobj(event.data_request)
+                frames = await self.data_socket.recv_multipart(copy=False)
+            try:
+                dispatcher = Dispatcher.from_frames(frames)
+            except ValueError as e:
+                # rejected by the data server, the trader raises on the same frames
+                await self.socket.send_multipart([event.pid] + frames, copy=False)
+                del self.account_queues[event.sid]
+                del self.feedbacks[event.sid]
+                self.logger.log_error(f'Account "{event.sid}" not created: {e}')
+                return False
+            data_obj = dispatcher.dispatch(own_loop=False)  # type: DataObject
 
             data_obj.set_event_queue(event.sid, self.event_queue)
-            self.accounts[event.sid] = Account(event.timestamp, data_obj, event.capital)
+            self.accounts[event.sid] = Account(event.timestamp, data_obj, event.capital, dispatcher.segment, event.pid,
+                                               dispatcher.stream)
 
-            await self.socket.send_multipart([event.pid, pickle.dumps(dispatcher)])
+            # the trader gets the very same frames
+            await self.socket.send_multipart([event.pid] + frames, copy=False)
             self.logger.log_info(f'Account "{event.sid}" created')
+            if dispatcher.stream is not None:
+                self.run_coroutine('', self.stream_data, event.sid, event.pid, dispatcher.stream)
 
         elif event.type == const.Event.SIGNAL:
-            if event.sid not in self.accounts:
-                raise ValueError(f'Account {event.sid} not exists')
-
-            # for simulated data, synchronize timestamp and send t-1 quote events to outside loop
-            if self.accounts[event.sid].broker == const.Broker.SIMULATED:
-                await self.accounts[event.sid].data_obj.set_time(event.timestamp)
-
-            await self.event_queue.put(event)
-            order = await feedback.get()  # type: OrderEvent
+            await self.process_signal(event, feedback)
 
-            if order.added():
-                position = self.accounts[event.sid].position
-
-                self.logger.log_info('############# PLAN #############')
-                for ticker, (_, delta) in order.orders.items():
-                    self.logger.log_info(f'{order.sid}: {ticker} ({position[ticker]} -> {position[ticker] + delta})')
-                self.logger.log_info('################################\n')
-
-                await self.event_queue.put(order)
-                filled = await feedback.get()
-                self.logger.log_info(filled)
-                position.update_from_fill(filled)
+        elif event.type == const.Event.SIGNAL_BATCH:
+            for signal_event in event.signals:
+                await self.process_signal(signal_event, feedback)
+            account = self.accounts[event.sid]
+            await self.socket.send_multipart([account.pid, account.codec.encode(SignalAckEvent(event.sid, event.seq))])
 
         elif event.type == const.Event.ACCT_CLOSE:
-            self.socket.send_multipart([event.pid, pickle.dumps(self.accounts[event.sid].position)])
-            del self.accounts[event.sid]
+            account = self.accounts[event.sid]
+            if account.broker == const.Broker.SIMULATED:
+                # bars after the last signal are only marked to market
+                account.position.take_snapshots(*account.data_obj.advance(event.timestamp))
+            self.socket.send_multipart([event.pid, pickle.dumps(account.position)])
+            del self.accounts[event.sid]  # stops streaming
+            if account.segment is not None or account.stream is not None:
+                async with self.data_lock:
+                    await self.data_socket.send_pyobj(DataReleaseEvent(account.segment, account.stream))
+                    await self.data_socket.recv_multipart()
+            del self.account_queues[event.sid]
+            del self.feedbacks[event.sid]
             self.logger.log_info(f'Account "{event.sid}" closed')
             return False
 
@@ -121,6 +145,59 @@ class PortfolioManager(AsyncAgent):
 
         return True
 
+    async def process_signal(self, event: SignalEvent, feedback: asyncio.Queue):
+        if event.sid not in self.accounts:
+            raise ValueError(f'Account {event.sid} not exists')
+
+        # for simulated data, synchronize timestamp and send t-1 quote events to outside loop
+        if self.accounts[event.sid].broker == const.Broker.SIMULATED:
+            await self.accounts[event.sid].data_obj.set_time(event.timestamp)
+
+        await self.event_queue.put(event)
+        order = await feedback.get()  # type: OrderEvent
+
+        if order.added():
+            position = self.accounts[event.sid].position
+
+            self.logger.log_info('############# PLAN #############')
+            for ticker, (_, delta) in order.items():
+                self.logger.log_info(f'{order.sid}: {ticker} ({position[ticker]} -> {position[ticker] + delta})')
+            self.logger.log_info('################################\n')
+
+            await self.event_queue.put(order)
+            filled = await feedback.get()
+            self.logger.log_info(filled)
+            try:
+                position.update_from_fill(filled)
+            except ValueError as e:
+                # the rest of the fill is dropped, the next signals of a batch still go through
+                self.logger.log_error(f'{e} at {event.timestamp}')
+
+    async def stream_data(self, sid, pid, stream):
+        """
+        pull the chunks of a streamed data object, keep them and pass them on to the trader
+        """
+        if sid not in self.accounts:  # closed before the stream was read to the end
+            return False
+        account = self.accounts[sid]
+
+        async with self.data_lock:
+            await self.data_socket.send_pyobj(DataChunkEvent(stream))
+            frames = await self.data_socket.recv_multipart(copy=False)
+        try:
+            last = account.data_obj.add_chunk(frames)
+        except ValueError as e:
+            # the data server has dropped the stream, the trader raises on the same frames
+            account.stream = None
+            await self.socket.send_multipart([pid] + frames, copy=False)
+            self.logger.log_error(f'Data stream {stream} of "{sid}" failed: {e}')
+            return False
+
+        if last:
+            account.stream = None
+        await self.socket.send_multipart([pid] + frames, copy=False)
+        return not last
+
     async def handle_events(self):
         event = await self.event_queue.get()  # type: Union[SignalEvent, FillEvent, QuoteEvent]
         self.logger.log_info(event)
@@ -128,27 +205,13 @@ class PortfolioManager(AsyncAgent):
         if event.type == const.Event.QUOTE:
             self.accounts[event.sid].position.take_snapshot(event.timestamp, event.quotes)
 
+        elif event.type == const.Event.QUOTE_BLOCK:
+            self.accounts[event.sid].position.take_snapshots(event.timestamps, event.prices)
+
         elif event.type == const.Event.SIGNAL:
             # convert signal to order
-            position = self.accounts[event.sid].position
-            data = self.accounts[event.sid].data_obj
-            unit_capital = position.get_equity() / sum([abs(x) for x in event.signal.values()])
-
-            order = OrderEvent(event.timestamp, event.sid)
-            buy_orders = []
-            for ticker, alpha in event.signal.items():
-                pos = int(alpha * unit_capital / data.get_close(ticker))
-                delta = pos - position[ticker]
-                if delta < 0:
-                    # we want to sell positions first because that releases capital
-                    order.add(ticker, const.Order.LMT, delta)
-                elif delta > 0:
-                    buy_orders.append([ticker, pos, delta])
-
-            # add remaining buy orders
-            for ticker, pos, delta in buy_orders:
-                order.add(ticker, const.Order.LMT, delta)
-
+            order = generate_order(event.timestamp, event.sid, event.signal, self.accounts[event.sid].position,
+                                   self.accounts[event.sid].data_obj.current_close)
             await self.feedbacks[event.sid].put(order)
 
         elif event.type == const.Event.ORDER:
@@ -161,10 +224,6 @@ class PortfolioManager(AsyncAgent):
 
     async def execute_simulated_order(self):
         order = await self.brokers[const.Broker.SIMULATED].get()  # type: OrderEvent
-        data = self.accounts[order.sid].data_obj
-        fill = FillEvent(order.timestamp, order.sid)
-        for ticker, (_, qty) in order.orders.items():
-            fill.add(ticker, data.get_close(ticker), qty)
-
+        fill = simulate_fill(order, self.accounts[order.sid].data_obj.current_close)
         await self.feedbacks[order.sid].put(fill)
         return True
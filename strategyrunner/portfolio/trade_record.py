@@ -3,6 +3,7 @@ import pandas as pd
 import numpy as np
 
 from ..event import FillEvent
+from ..helpers import TickerIndex, SparseVector
 
 
 class Datum:
@@ -26,12 +27,18 @@ class Datum:
 
 class TradeRecord:
     def __init__(self, timestamp, initial_capital, tickers):
+        """
+        tickers is a list or the TickerIndex of the data object, positions and commissions are arrays in its order
+        """
         self.cash = initial_capital
-        self.tickers = tickers
-        self.positions = {ticker: 0 for ticker in tickers}
-        self.commissions = {ticker: 0 for ticker in tickers}
+        self.index = tickers if isinstance(tickers, TickerIndex) else TickerIndex(tickers)
+        self.tickers = self.index.tickers
+        self.positions = np.zeros(len(self.index), dtype='int64')
+        self.commissions = np.zeros(len(self.index))
+        self.commission = 0.0  # total of commissions
+        self.prices = np.zeros(len(self.index))  # last quoted prices
         self.snapshots = []
-        self.take_snapshot(timestamp, {ticker: 0 for ticker in tickers})
+        self.take_snapshot(timestamp, self.prices)
 
     def __str__(self):
         if len(self.snapshots) == 0:
@@ -46,19 +53,29 @@ class TradeRecord:
         return self.__str__()
 
     def __getitem__(self, item):
-        return self.positions[item]
+        return int(self.positions[self.index[item]])
 
     def update(self, ticker, quantity, price, commission):
         delta = quantity * price
         if delta > self.cash:
             raise ValueError('Cash become negative')
-        self.positions[ticker] += quantity
-        self.cash -= delta
-        self.commissions[ticker] += commission
+        self._update(self.index[ticker], quantity, price, commission)
 
     def update_from_fill(self, fill: FillEvent):
-        for ticker, (qty, price, comm) in fill.fills.items():
-            self.update(ticker, qty, price, comm)
+        """
+        fills are applied in order, so a fill that can't be paid for leaves the ones before it in place
+        """
+        for idx, qty, price, comm in zip(fill.positions.tolist(), fill.quantities.tolist(), fill.prices.tolist(),
+                                         fill.commissions.tolist()):
+            if qty * price > self.cash:
+                raise ValueError('Cash become negative')
+            self._update(idx, qty, price, comm)
+
+    def _update(self, idx, quantity, price, commission):
+        self.positions[idx] += quantity
+        self.cash -= quantity * price
+        self.commissions[idx] += commission
+        self.commission += commission
 
     def get_equity(self):
         return self.snapshots[-1]["equity"]
@@ -68,15 +85,37 @@ class TradeRecord:
         return pd.DataFrame(data).set_index('date')
 
     def take_snapshot(self, timestamp, prices):
-        # snapshot of market values
-        record = {
-            'asset': {ticker: Datum(self.positions[ticker], prices[ticker]) for ticker in self.tickers},
-            'commission': sum(self.commissions.values()),
-            'timestamp': timestamp
-        }
-        record['cash'] = self.cash - record['commission']
-        record['equity'] = sum(record['asset'].values()) + record['cash']
-        self.snapshots.append(record)
+        """
+        snapshot of market values of the held tickers, prices is a SparseVector of the prices that changed or
+        a dense array in ticker index order
+        """
+        if isinstance(prices, SparseVector):
+            self.prices[prices.positions] = prices.values
+        else:
+            self.prices[:] = prices
+        self.take_snapshots([timestamp], self.prices[np.newaxis])
+
+    def take_snapshots(self, timestamps, prices):
+        """
+        snapshots of consecutive bars without trading in between, prices has a dense row per timestamp. the held
+        positions are marked to market for all bars at once
+        """
+        if len(timestamps) == 0:
+            return
+        held = np.flatnonzero(self.positions != 0)
+        tickers, quantities = self.index.decode(held.tolist()), self.positions[held]
+        sizes = quantities.tolist()
+        block = prices[:, held]
+        cash = self.cash - self.commission
+        for timestamp, row, mtm in zip(timestamps, block.tolist(), (block @ quantities).tolist()):
+            self.snapshots.append({
+                'asset': {ticker: Datum(qty, price) for ticker, qty, price in zip(tickers, sizes, row)},
+                'commission': self.commission,
+                'timestamp': timestamp,
+                'cash': cash,
+                'equity': mtm + cash
+            })
+        self.prices[:] = prices[-1]
 
     def get_sharpe_ratio(self):
         ts = self._get_equity_curve()
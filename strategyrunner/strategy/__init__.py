@@ -1,4 +1,5 @@
 
 from .strategy import Strategy
+from .schedule import RebalanceSchedule, EveryNBars, MonthEnd, CalendarPredicate
 from .momentum import MomentumStrategy
 from .buy_and_hold import BuyAndHold
\ No newline at end of file
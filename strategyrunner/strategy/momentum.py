@@ -13,6 +13,4 @@ class MomentumStrategy(Strategy):
     def set_signal(self, signal):
         returns = self.data.close[-1] / self.data.close[-self.period] - 1
         selected = np.argsort(returns) < self.top
-        for ind, ticker in zip(selected, self.data.tickers):
-            if ind > 0:
-                signal[ticker] = int(ind)
+        signal.values()[selected] = 1  # data columns and signal share the ticker index
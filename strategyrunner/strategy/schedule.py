@@ -0,0 +1,71 @@
+"""
+rebalance schedules, the trader only asks a strategy for a signal on the bars its schedule is due
+"""
+
+from abc import ABC, abstractmethod
+import pandas as pd
+
+
+class RebalanceSchedule(ABC):
+    @abstractmethod
+    def is_due(self, now, next_time) -> bool:
+        """
+        called once on every bar, now is the bar's timestamp and next_time the next bar's, None if not known yet
+        """
+        raise NotImplementedError('is_due is not implemented')
+
+
+class EveryNBars(RebalanceSchedule):
+    """
+    the first bar and every n-th bar after it
+    """
+    def __init__(self, n, offset=0):
+        if n < 1:
+            raise ValueError('Rebalance period should be at least 1 bar')
+        self.n = n
+        self.offset = offset
+        self.bars = 0
+
+    def is_due(self, now, next_time):
+        due = self.bars % self.n == self.offset % self.n
+        self.bars += 1
+        return due
+
+    def __str__(self):
+        return f'Every {self.n} bars'
+
+    def __repr__(self):
+        return self.__str__()
+
+
+class MonthEnd(RebalanceSchedule):
+    """
+    the last bar of every month, when the next bar isn't known the last business day is taken instead
+    """
+    def is_due(self, now, next_time):
+        if next_time is None:
+            next_time = now + pd.offsets.BDay(1)
+        return (next_time.year, next_time.month) != (now.year, now.month)
+
+    def __str__(self):
+        return 'Month end'
+
+    def __repr__(self):
+        return self.__str__()
+
+
+class CalendarPredicate(RebalanceSchedule):
+    """
+    the bars for which predicate(timestamp) is true
+    """
+    def __init__(self, predicate):
+        self.predicate = predicate
+
+    def is_due(self, now, next_time):
+        return bool(self.predicate(now))
+
+    def __str__(self):
+        return f'Calendar predicate {getattr(self.predicate, "__name__", self.predicate)}'
+
+    def __repr__(self):
+        return self.__str__()
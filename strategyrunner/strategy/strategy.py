@@ -3,6 +3,7 @@ from abc import ABC, abstractmethod
 from ..data import DataObject
 from ..logger import Logger
 from ..helpers import Signal
+from .schedule import RebalanceSchedule
 
 
 class Strategy(ABC):
@@ -12,6 +13,7 @@ class Strategy(ABC):
         self.logger = logger
         self.data = data
         self.look_back = -1
+        self.schedule = None  # type: RebalanceSchedule  # signal on every bar when None
         self._setup()  # for user initialization
 
     @abstractmethod
@@ -22,6 +24,14 @@ class Strategy(ABC):
     def _setup(self):
         pass
 
+    def is_rebalancing(self) -> bool:
+        """
+        called by the trader once on every bar, set_signal is only called when this is True
+        """
+        if self.schedule is None:
+            return True
+        return self.schedule.is_due(self.data.now, self.data.next_timestamp)
+
 
 class HyperParameter:
     counter = 0
@@ -1,5 +1,7 @@
 
 import queue
+import collections
+import pickle
 import zmq
 import pandas as pd
 from typing import Type
@@ -7,12 +9,16 @@ import time
 
 from .strategy import Strategy
 from .logger import Logger
-from .data import DataObject
-from .event import AccountOpenEvent, AccountCloseEvent, SignalEvent
+from .data import DataObject, Dispatcher
+from .event import AccountOpenEvent, AccountCloseEvent, SignalEvent, DataRequestEvent, DataChunkEvent, \
+    DataReleaseEvent, SignalBatchEvent
 from .portfolio.trade_record import TradeRecord
+from .portfolio.local_engine import LocalEngine
 from . import const
 from . import utils
 from .helpers import Signal
+from .codec import EventCodec
+from . import codec
 
 
 class Trader:
@@ -29,7 +35,12 @@ class Trader:
         self.end_time = None
         self.initial_capital = None
         self.broker = None
+        self.chunk_size = None
+        self.engine = const.Engine.DISTRIBUTED
         self.strategy = None
+        self.data_socket = None  # to the data server when trading locally
+        self.segment = None  # shared memory data to release when trading locally
+        self.stream = None  # data stream to release when trading locally, if it isn't read to the end
 
         self.strategy_name = strategy_class.name + '-' + utils.get_name_hash()
         self.logger.log_info(f'Executing strategy {self.strategy_name}')
@@ -38,6 +49,16 @@ class Trader:
         self.socket = zmq.Context().socket(zmq.DEALER)
         self.socket.setsockopt(zmq.IDENTITY, self.strategy_name.encode())
         self.socket.connect(f'tcp://127.0.0.1:{config["manager_request_port"]}')
+        self.data_port = config['data_server_request_port']
+
+        # simulated signals are sent in batches with at most signal_window of them not yet acknowledged
+        self.signal_batch = config.get('signal_batch', 32)
+        self.signal_window = config.get('signal_window', 256)
+        self.pending = []  # type: list[SignalEvent]
+        self.sent = 0
+        self.acked = 0
+        self.chunks = collections.deque()  # data chunks received while waiting for acknowledgements
+        self.codec = None  # type: EventCodec
 
     def set_tickers(self, tickers):
         self.tickers = tickers
@@ -52,6 +73,27 @@ class Trader:
     def set_broker(self, broker: const.Broker):
         self.broker = broker
 
+    def set_chunk_size(self, bars):
+        """
+        stream historical data in chunks of bars so that trading starts before all of it is loaded
+        """
+        self.chunk_size = bars
+
+    def set_signal_window(self, batch, window):
+        """
+        send simulated signals batch at a time, with up to window signals ahead of the manager
+        """
+        if window < batch:
+            raise ValueError('Signal window must hold at least one batch')
+        self.signal_batch = batch
+        self.signal_window = window
+
+    def set_engine(self, engine: const.Engine):
+        """
+        the local engine runs simulated trading in this process, with the same results as the portfolio manager
+        """
+        self.engine = engine
+
     def trade(self):
         # check if necessary vales are set
         if self.initial_capital is None:
@@ -59,48 +101,160 @@ class Trader:
         if self.broker is None:
             raise ValueError("Broker is not set")
 
+        if self.engine == const.Engine.LOCAL and self.broker != const.Broker.SIMULATED:
+            raise ValueError('Local engine only supports the simulated broker')
+
+        try:
+            result = self._run()
+        except Exception as e:
+            # the logger runs its own thread, the process couldn't exit with it left open
+            self.logger.log_error(f'Trading stopped: {e}')
+            self.logger.close()
+            raise
+
+        self.logger.close()
+        return result
+
+    def _run(self):
         wall_time_start = time.time()
 
-        self._set_data_obj()
+        if self.engine == const.Engine.LOCAL:
+            self._set_local_data_obj()
+            engine = LocalEngine(self.logger, self.start_time, self.data_obj, self.initial_capital)
+        else:
+            self._set_data_obj()
         self.strategy = self.strategy_class(self.logger, self.data_obj)
         self.data_obj.set_look_back(self.strategy.look_back)
 
         # main signal generation loop
-        signal = Signal(self.data_obj.tickers)
+        signal = Signal(self.data_obj.index)
         while self.data_obj.update_bar():
+            if not self.strategy.is_rebalancing():
+                continue  # idle bars are marked to market in bulk with the next signal
             signal.reset()  # set all alphas to 0
             self.strategy.set_signal(signal)
             signal_event = SignalEvent(self.data_obj.now, self.strategy_name, signal)
-            self.socket.send_pyobj(signal_event)
+            if self.engine == const.Engine.LOCAL:
+                engine.on_signal(signal_event)
+            elif self.broker == const.Broker.SIMULATED:
+                signal_event.signal = signal.copy()  # signal is reused for the next bar
+                self._submit_signal(signal_event)
+            else:
+                self.socket.send(self.codec.encode(signal_event))
             if self.verbose:
                 self.logger.log_info(signal_event)
 
         wall_time_end = time.time()
         self.logger.log_info(f'Wall time: {wall_time_end - wall_time_start: .2f}s')
 
-        if self.end_time is None:  # real-time
-            self.socket.send_pyobj(AccountCloseEvent(pd.Timestamp.now(), self.strategy_name))
+        if self.engine == const.Engine.LOCAL:
+            result = engine.close()
+            self._release_local_data_obj()
         else:
-            self.socket.send_pyobj(AccountCloseEvent(self.end_time, self.strategy_name))
+            self._flush_signals()
+            if self.end_time is None:  # real-time
+                self.socket.send_pyobj(AccountCloseEvent(pd.Timestamp.now(), self.strategy_name))
+            else:
+                self.socket.send_pyobj(AccountCloseEvent(self.end_time, self.strategy_name))
+            result = self._receive('result')  # type: TradeRecord
 
-        result = self.socket.recv_pyobj()  # type: TradeRecord
         self.logger.log_info(f'Final capital: {result.get_equity()}')
         self.logger.log_info(f'Book-keeping time: {time.time() - wall_time_end: .2f}s')
 
-        self.logger.close()
+        return result
 
     def _set_data_obj(self):
         if self.tickers is None:
             raise ValueError("Tickers are not set")
 
-        event = AccountOpenEvent(self.start_time, self.strategy_name, 10000, self.broker, self.tickers,
-                                 self.start_time, self.end_time)
+        event = AccountOpenEvent(self.start_time, self.strategy_name, self.initial_capital, self.broker, self.tickers,
+                                 self.start_time, self.end_time, chunk_size=self.chunk_size)
 
         self.logger.log_info(f'Requesting data: {event.data_request}')
         self.socket.send_pyobj(event)
-        self.data_obj = self.socket.recv_pyobj().dispatch()  # type: DataObject
+        self.data_obj = Dispatcher.from_frames(self.socket.recv_multipart(copy=False)).dispatch()  # type: DataObject
+        self.codec = EventCodec(self.data_obj.index)  # the manager builds the same from the same frames
+        if self.data_obj.type == const.Data.SIMULATED and self.data_obj.loaded_row < self.data_obj.last_row:
+            self.data_obj.set_feed(self._receive_chunk)
 
         if self.data_obj.type == const.Data.SIMULATED:
             self.logger.log_info(f'Historical data object received with {self.data_obj.last_row} data points')
         else:
             self.logger.log_info('Data object received')
+
+    def _submit_signal(self, event: SignalEvent):
+        self.pending.append(event)
+        if len(self.pending) >= self.signal_batch:
+            self._flush_signals()
+
+    def _flush_signals(self):
+        if len(self.pending) == 0:
+            return
+        while self.sent + len(self.pending) - self.acked > self.signal_window:
+            self._receive('ack')
+
+        self.sent += len(self.pending)
+        self.socket.send(self.codec.encode(SignalBatchEvent(self.pending[-1].timestamp, self.strategy_name,
+                                                            self.pending, self.sent)))
+        self.pending = []
+
+    def _receive(self, until):
+        """
+        demultiplex what the manager sends until the wanted kind of message arrives, 'ack', 'chunk' or 'result'
+        data chunks are json, acknowledgements are binary encoded and the pickled result is returned
+        """
+        while True:
+            frames = self.socket.recv_multipart(copy=False)
+            if frames[0].bytes[:1] == b'{':
+                self.chunks.append(frames)
+                if until == 'chunk':
+                    return None
+                continue
+
+            msg = self.codec.decode(frames[0].bytes) if codec.is_encoded(frames[0].bytes) \
+                else pickle.loads(frames[0].bytes)
+            if getattr(msg, 'type', None) == const.Event.SIGNAL_ACK:
+                self.acked = max(self.acked, msg.seq)
+                if until == 'ack':
+                    return None
+                continue
+            return msg
+
+    def _receive_chunk(self):
+        while len(self.chunks) == 0:
+            msg = self._receive('chunk')
+            if msg is not None:
+                raise ValueError(f'Unexpected message while waiting for data: {msg}')
+        return self.chunks.popleft()
+
+    def _set_local_data_obj(self):
+        """
+        request the data object from the data server directly, there is no account at the manager
+        """
+        if self.tickers is None:
+            raise ValueError("Tickers are not set")
+
+        request = DataRequestEvent(self.broker, self.tickers, self.start_time, self.end_time, self.chunk_size)
+        self.logger.log_info(f'Requesting data: {request}')
+        self.data_socket = zmq.Context().socket(zmq.REQ)
+        self.data_socket.connect(f'tcp://127.0.0.1:{self.data_port}')
+        self.data_socket.send_pyobj(request)
+        dispatcher = Dispatcher.from_frames(self.data_socket.recv_multipart(copy=False))
+        self.segment = dispatcher.segment
+        self.stream = dispatcher.stream
+        self.data_obj = dispatcher.dispatch()
+
+        if self.data_obj.loaded_row < self.data_obj.last_row:
+            self.data_obj.set_feed(lambda: self._request_chunk(dispatcher.stream))
+        self.logger.log_info(f'Historical data object received with {self.data_obj.last_row} data points')
+
+    def _request_chunk(self, stream):
+        self.data_socket.send_pyobj(DataChunkEvent(stream))
+        return self.data_socket.recv_multipart(copy=False)
+
+    def _release_local_data_obj(self):
+        stream = self.stream if self.data_obj.loaded_row < self.data_obj.last_row else None
+        if self.segment is not None or stream is not None:
+            self.data_socket.send_pyobj(DataReleaseEvent(self.segment, stream))
+            self.data_socket.recv_multipart()
+        self.data_socket.close()
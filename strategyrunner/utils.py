@@ -7,6 +7,7 @@ import os
 import pathlib
 import numpy as np
 import string
+import time
 
 
 def rdate(period):
@@ -51,3 +52,29 @@ def get_no_conflict_filename(filename):
         if not new_file.exists():
             break
     return new_file
+
+
+class RateMeter:
+    """
+    events per second over reporting windows
+    """
+    def __init__(self):
+        self.total = 0
+        self.count = 0
+        self.start = time.perf_counter()
+
+    def add(self, count=1):
+        self.total += count
+        self.count += count
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def reset(self):
+        """
+        return the rate since the last reset
+        """
+        rate = self.count / max(self.elapsed(), 1e-9)
+        self.count = 0
+        self.start = time.perf_counter()
+        return rate